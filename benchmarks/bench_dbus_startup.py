@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Latency of the daemon attaching to the screen saver, against a private bus.
+
+Starts a private dbus-daemon and a headless `bundyclock -d` on it, then
+after --delay seconds a stand-in org.gnome.ScreenSaver service. Measures
+the time from the service owning its name until the daemon has connected
+to its signals, and the daemon's time to attach when the service is
+already running at startup. Exits non-zero if an attach is over budget.
+Needs dbus-daemon, dbus-python and PyGObject:
+
+    python benchmarks/bench_dbus_startup.py [--runs 5] [--delay 2] [--budget-ms 100]
+"""
+import argparse
+import os
+import queue
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+CONFIG = """[bundyclock]
+ledger_type = sqlite
+ledger_file = in_out_times.db
+control_socket =
+event_sources = screensaver
+systray = no
+"""
+
+SCREEN_SAVER = """
+import sys, time
+import dbus, dbus.service
+from dbus.mainloop.glib import DBusGMainLoop
+from gi.repository import GLib
+
+DBusGMainLoop(set_as_default=True)
+bus = dbus.SessionBus()
+
+
+class ScreenSaver(dbus.service.Object):
+    @dbus.service.signal('org.gnome.ScreenSaver', signature='b')
+    def ActiveChanged(self, active):
+        pass
+
+
+saver = ScreenSaver(bus, '/org/gnome/ScreenSaver')
+name = dbus.service.BusName('org.gnome.ScreenSaver', bus)
+print(time.time(), flush=True)
+GLib.MainLoop().run()
+"""
+
+ATTACHED = 'Enabling gnome screen saver watcher'
+WAITING = 'Waiting for a screen saver'
+
+
+def start_bus():
+    bus = subprocess.Popen(['dbus-daemon', '--session', '--nofork', '--print-address=1'],
+                           stdout=subprocess.PIPE, text=True)
+    return bus, bus.stdout.readline().strip()
+
+
+def log_lines(proc):
+    """ queue of (time read, line) of proc's output """
+    lines = queue.Queue()
+
+    def reader():
+        for line in proc.stdout:
+            lines.put((time.time(), line))
+    threading.Thread(target=reader, daemon=True).start()
+    return lines
+
+
+def wait_for(lines, text, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            seen, line = lines.get(timeout=max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+            break
+        if text in line:
+            return seen
+    sys.exit('Daemon never logged "{}"'.format(text))
+
+
+def stop(*procs):
+    for proc in procs:
+        if proc is not None and proc.poll() is None:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def run_once(home, config_file, delay):
+    """ (attach latency after the service appears, startup time when it was already there) """
+    bus, address = start_bus()
+    env = dict(os.environ, HOME=home, DBUS_SESSION_BUS_ADDRESS=address, DESKTOP_SESSION='gnome')
+    daemon_cmd = [sys.executable, '-m', 'bundyclock.bundyclock', '-d', '--config', config_file]
+    daemon = saver = None
+    try:
+        # the screen saver appears after the daemon is up
+        daemon = subprocess.Popen(daemon_cmd, env=env, stdin=subprocess.DEVNULL,
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        lines = log_lines(daemon)
+        wait_for(lines, WAITING)
+        time.sleep(delay)
+        saver = subprocess.Popen([sys.executable, '-c', SCREEN_SAVER], env=env, stdout=subprocess.PIPE, text=True)
+        owned = float(saver.stdout.readline())
+        late = wait_for(lines, ATTACHED) - owned
+        stop(daemon)
+
+        # the screen saver is there when the daemon starts
+        started = time.time()
+        daemon = subprocess.Popen(daemon_cmd, env=env, stdin=subprocess.DEVNULL,
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        present = wait_for(log_lines(daemon), ATTACHED) - started
+    finally:
+        stop(daemon, saver, bus)
+
+    return late, present
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--delay', type=float, default=2, help='seconds before the screen saver appears')
+    parser.add_argument('--budget-ms', type=float, default=100,
+                        help='allowed time from the screen saver appearing until the daemon has attached')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        config_file = os.path.join(home, 'bundyclock.cfg')
+        with open(config_file, 'w') as fd:
+            fd.write(CONFIG)
+        results = [run_once(home, config_file, args.delay) for _ in range(args.runs)]
+
+    late = [r[0] * 1000 for r in results]
+    present = [r[1] * 1000 for r in results]
+    print('runs {}, screen saver appearing {} s after the daemon'.format(args.runs, args.delay))
+    print('attach after appearing  median {:>8.1f} ms  max {:>8.1f} ms'.format(statistics.median(late), max(late)))
+    print('startup, already there  median {:>8.1f} ms  max {:>8.1f} ms'.format(
+        statistics.median(present), max(present)))
+
+    if max(late) > args.budget_ms:
+        sys.exit('Over budget of {:.0f} ms'.format(args.budget_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Throughput of the whole daemon pipeline, headless.
+
+Runs `bundyclock -d` without tray icon or desktop session in a throw-away
+home directory, with a replay event source feeding a synthetic stream of
+lock, unlock and break events through the lock screen handlers, the
+debounce filter and the ledger worker into the ledger. The daemon exits at
+the end of the stream, after the ledger has written everything:
+
+    python benchmarks/bench_replay.py [--events 100000] [--ledger-type sqlite] [--min-away 0]
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+CONFIG = """[bundyclock]
+ledger_type = {ledger_type}
+ledger_file = in_out_times.db
+durability = {durability}
+control_socket =
+event_sources = replay:{events_file}
+systray = no
+min_away = {min_away}
+coalesce_window = {coalesce_window}
+"""
+
+
+def write_events(filename, count, seed=0):
+    """ alternating locks and unlocks, with a break before every tenth lock """
+    rnd = random.Random(seed)
+    t = time.time() - count * 60
+    with open(filename, 'w') as fd:
+        for i in range(count):
+            t += rnd.randint(1, 120)
+            event = 'lock' if i % 2 == 0 else 'unlock'
+            if event == 'lock' and rnd.random() < 0.1:
+                fd.write('{} break\n'.format(time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(t))))
+            fd.write('{} {}\n'.format(time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(t)), event))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--ledger-type', default='sqlite',
+                        help='text, json, jsonl, sqlite or sqlite-events')
+    parser.add_argument('--durability', default='event', help='sqlite ledgers, event, interval or exit')
+    parser.add_argument('--min-away', type=float, default=0, help='debounce, see the config template')
+    parser.add_argument('--coalesce-window', type=float, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        events_file = os.path.join(home, 'events.txt')
+        write_events(events_file, args.events)
+        config_file = os.path.join(home, 'bundyclock.cfg')
+        with open(config_file, 'w') as fd:
+            fd.write(CONFIG.format(ledger_type=args.ledger_type, durability=args.durability,
+                                   events_file=events_file, min_away=args.min_away,
+                                   coalesce_window=args.coalesce_window))
+
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-m', 'bundyclock.bundyclock', '-d', '--config', config_file],
+                              env=dict(os.environ, HOME=home), stdin=subprocess.DEVNULL,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        elapsed = time.perf_counter() - start
+        if proc.returncode:
+            sys.exit('daemon failed:\n{}'.format(proc.stdout))
+
+    replayed = [line for line in proc.stdout.splitlines() if 'Replayed' in line]
+    print('ledger {}, durability {}, min_away {}, coalesce_window {}'.format(
+        args.ledger_type, args.durability, args.min_away, args.coalesce_window))
+    print('events        {:>10}'.format(args.events))
+    print('daemon        {:>10.2f} s'.format(elapsed))
+    print('throughput    {:>10.0f} events/s'.format(args.events / elapsed))
+    if replayed:
+        print(replayed[-1].split('INFO: ')[-1])
+
+
+if __name__ == '__main__':
+    main()
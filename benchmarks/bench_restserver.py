@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Load test of the workdays REST API server (bundyclock.restserver).
+
+Starts the server in a subprocess with a fresh data dir, gives every user
+a year of history and lets `clients` concurrent keep-alive clients punch
+and read for `duration` seconds, the way the http-rest ledger does. Prints
+throughput, latency percentiles and errors:
+
+    python benchmarks/bench_restserver.py [--clients 200] [--users 50] [--workers 16]
+"""
+import argparse
+import datetime
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+import synthetic
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.05)
+    sys.exit('Server did not start')
+
+
+def load_history(base_url, users):
+    history = [dict(date=w['day'].isoformat(), intime=w['intime'], outtime=w['outtime'])
+               for w in synthetic.workdays(1)]
+    with requests.Session() as session:
+        for user in users:
+            session.post('{}/{}/workdays/'.format(base_url, user), json=history).raise_for_status()
+
+
+def client(base_url, user, stop, latencies, errors, rnd):
+    """ punches today and now and then reads a month or the totals, like a bundyclock daemon and CLI """
+    today = datetime.date.today().isoformat()
+    month = today[:8]
+    url = '{}/{}/workdays/'.format(base_url, user)
+    with requests.Session() as session:
+        while not stop.is_set():
+            op = rnd.random()
+            start = time.perf_counter()
+            try:
+                if op < 0.5:
+                    r = session.get(url + today + '/', timeout=10)
+                    now = time.strftime('%H:%M:%S')
+                    if r.status_code == 404:
+                        r = session.post(url, data=dict(date=today, intime=now, outtime=now), timeout=10)
+                        if r.status_code == 400:
+                            # created by another client of the same user
+                            r.status_code = 201
+                    else:
+                        workday = r.json()
+                        workday['outtime'] = max(now, workday['intime'])
+                        r = session.put(url + today + '/', data=workday, timeout=10)
+                elif op < 0.8:
+                    r = session.get(url + '?start_date={}01&end_date={}31'.format(month, month), timeout=10)
+                else:
+                    r = session.get(url + 'total_sum/?start_date={}01&end_date={}'.format(month, today),
+                                    timeout=10)
+                if r.status_code >= 400:
+                    errors.append(r.status_code)
+            except requests.exceptions.RequestException as e:
+                errors.append(type(e).__name__)
+            latencies.append(time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--clients', type=int, default=200, help='concurrent clients')
+    parser.add_argument('--users', type=int, default=50, help='distinct users (databases)')
+    parser.add_argument('--workers', type=int, default=16, help='server worker threads')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load')
+    args = parser.parse_args()
+
+    port = free_port()
+    base_url = 'http://127.0.0.1:{}'.format(port)
+    users = ['user{}'.format(i) for i in range(args.users)]
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'bundyclock.restserver', '--port', str(port), '--data-dir', data_dir,
+             '--workers', str(args.workers)],
+            stdout=subprocess.DEVNULL, env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+        try:
+            wait_for(base_url + '/')
+            load_history(base_url, users)
+
+            stop = threading.Event()
+            latencies, errors = [], []
+            threads = [threading.Thread(target=client, args=(base_url, users[i % len(users)], stop, latencies,
+                                                             errors, random.Random(i)))
+                       for i in range(args.clients)]
+            for t in threads:
+                t.start()
+            time.sleep(args.duration)
+            stop.set()
+            for t in threads:
+                t.join()
+        finally:
+            server.terminate()
+            server.wait()
+
+    latencies.sort()
+    print('clients {}, users {}, workers {}'.format(args.clients, args.users, args.workers))
+    print('requests      {:>10}'.format(len(latencies)))
+    print('throughput    {:>10.0f} req/s'.format(len(latencies) / args.duration))
+    for p in (50, 90, 99):
+        print('p{:<12} {:>10.1f} ms'.format(p, latencies[int(len(latencies) * p / 100) - 1] * 1000))
+    print('max           {:>10.1f} ms'.format(latencies[-1] * 1000))
+    print('mean          {:>10.1f} ms'.format(statistics.mean(latencies) * 1000))
+    print('errors        {:>10}{}'.format(len(errors), ' ' + str(sorted(set(map(str, errors)))) if errors else ''))
+
+
+if __name__ == '__main__':
+    main()
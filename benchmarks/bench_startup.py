@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Startup time of the plain `bundyclock` punch path, checked against a budget.
+
+Runs the CLI in a throw-away home directory with a sqlite ledger, reports
+the wall-clock time above bare interpreter startup and lists the modules
+the punch path must not import. Exits non-zero if the median overhead is
+over budget or a heavy module was imported:
+
+    python benchmarks/bench_startup.py [--budget-ms 100] [--runs 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Only needed by other subcommands or the daemon
+HEAVY_MODULES = ('requests', 'dateutil', 'pkg_resources', 'jinja2', 'dbus', 'gi', 'pystray', 'PIL')
+
+CONFIG = """[bundyclock]
+ledger_type = sqlite
+ledger_file = in_out_times.db
+template = default_report.j2
+"""
+
+
+def timed_run(cmd, env):
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode:
+        sys.exit('{} failed:\n{}'.format(' '.join(cmd), proc.stderr))
+    return elapsed, proc.stderr
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--budget-ms', type=float, default=100,
+                        help='allowed median time above bare interpreter startup')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        config_file = os.path.join(home, 'bundyclock.cfg')
+        with open(config_file, 'w') as fd:
+            fd.write(CONFIG)
+
+        env = dict(os.environ, HOME=home)
+        punch = [sys.executable, '-m', 'bundyclock.bundyclock', '--config', config_file]
+
+        # first run creates the database, not part of the measurement
+        _, importtime = timed_run([sys.executable, '-X', 'importtime'] + punch[1:], env)
+        imported = {line.split('|')[-1].strip().split('.')[0] for line in importtime.splitlines()
+                    if line.startswith('import time:')}
+
+        bare = [timed_run([sys.executable, '-c', 'pass'], env)[0] for _ in range(args.runs)]
+        punches = [timed_run(punch, env)[0] for _ in range(args.runs)]
+
+    overhead_ms = (statistics.median(punches) - statistics.median(bare)) * 1000
+    heavy = sorted(set(HEAVY_MODULES) & imported)
+
+    print('interpreter startup  {:8.1f} ms'.format(statistics.median(bare) * 1000))
+    print('punch path           {:8.1f} ms'.format(statistics.median(punches) * 1000))
+    print('overhead             {:8.1f} ms (budget {:.0f} ms)'.format(overhead_ms, args.budget_ms))
+    print('heavy modules        {}'.format(', '.join(heavy) or 'none'))
+
+    if heavy or overhead_ms > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the TextOutput tail reader against multi-megabyte ledgers.
+
+The whole-file approach it replaced (readlines + reversed) is timed
+alongside for reference. Usage:
+
+    python benchmarks/bench_text_ledger.py [--sizes 1 8 32]
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+import timeit
+
+from bundyclock.ledgers.ledgers import TextOutput
+
+
+def write_ledger(filename, megabytes):
+    """ Synthetic text ledger of roughly the given size, ending with today """
+    day = datetime.date.today()
+    lines = []
+    size = 0
+    while size < megabytes * 1024 * 1024:
+        line = '{} - In: 08:{:02d}:00 Out: 17:{:02d}:00 Total: 09:00:00\n'.format(
+            day.strftime('%Y.%m.%d'), day.day % 60, day.toordinal() % 60)
+        lines.append(line)
+        size += len(line)
+        day -= datetime.timedelta(days=1)
+
+    with open(filename, 'w') as fd:
+        fd.writelines(reversed(lines))
+
+    return len(lines)
+
+
+def readlines_get_today(filename):
+    today = time.strftime('%Y.%m.%d')
+    with open(filename, 'rb') as fd:
+        for line in reversed(fd.readlines()):
+            if TextOutput.RECORD.match(line.decode()).group('day') == today:
+                return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1, 8, 32],
+                        metavar='MB', help='ledger sizes in megabytes')
+    parser.add_argument('--number', type=int, default=200, help='calls per timing')
+    args = parser.parse_args()
+
+    print('{:>6} {:>9} {:>18} {:>16} {:>16}'.format(
+        'MB', 'records', 'get_today (us)', 'out_signal (us)', 'readlines (us)'))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for megabytes in args.sizes:
+            filename = os.path.join(tmp, 'ledger_{}.txt'.format(megabytes))
+            records = write_ledger(filename, megabytes)
+            ledger = TextOutput(filename)
+
+            results = [timeit.timeit(f, number=args.number) / args.number * 1e6 for f in (
+                ledger.get_today,
+                ledger.out_signal,
+                lambda: readlines_get_today(filename),
+            )]
+            print('{:>6} {:>9} {:>18.1f} {:>16.1f} {:>16.1f}'.format(megabytes, records, *results))
+
+
+if __name__ == '__main__':
+    main()
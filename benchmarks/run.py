@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite timing every ledger type over synthetic multi-year histories.
+
+Each ledger type is filled with 1, 5 and 20 years of workdays (breaks and
+notes included) and the punch, read and report operations are timed. The
+http-rest ledger runs against a local stub server. Results are written as
+JSON so runs of different releases can be compared:
+
+    python benchmarks/run.py --output before.json
+    python benchmarks/run.py --output after.json --compare before.json
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import tempfile
+import time
+import timeit
+
+import stub_server
+import synthetic
+
+from bundyclock import report
+from bundyclock.ledgers.dbledger import SqLiteOutput, SqLiteEventOutput
+from bundyclock.ledgers.factory import get_ledger
+from bundyclock.ledgers.ledgers import BundyLedger
+
+LEDGER_TYPES = ('text', 'json', 'jsonl', 'sqlite', 'sqlite-events', 'http-rest')
+
+
+def create_ledger(ledger_type, years, work_dir):
+    base = os.path.join(work_dir, ledger_type.replace('-', '_'))
+    config = dict(ledger_type=ledger_type, ledger_file=base)
+
+    if ledger_type == 'text':
+        synthetic.write_text(base + '.txt', years)
+    elif ledger_type == 'json':
+        synthetic.write_json(base + '.json', years)
+    elif ledger_type == 'jsonl':
+        synthetic.write_jsonl(base + '.jsonl', years)
+    elif ledger_type == 'sqlite':
+        synthetic.write_sqlite(base + '.db', years, SqLiteOutput)
+    elif ledger_type == 'sqlite-events':
+        synthetic.write_sqlite(base + '.db', years, SqLiteEventOutput)
+    elif ledger_type == 'http-rest':
+        server, url = stub_server.start(synthetic.http_records(years))
+        config.update(url=url, outbox_file=base + '_outbox.db')
+
+    return get_ledger(**config)
+
+
+def operations(ledger):
+    """ name -> callable for every operation the ledger supports """
+    ops = dict(
+        in_signal=ledger.in_signal,
+        out_signal=ledger.out_signal,
+        flush=ledger.flush,
+        get_today=ledger.get_today,
+    )
+    if type(ledger).take_a_break is not BundyLedger.take_a_break:
+        ops['take_a_break'] = ledger.take_a_break
+    if ledger.can_report:
+        year_month = time.strftime('%Y-%m')
+        last_year = str(datetime.date.today().year - 1)
+        ops.update(
+            get_month=lambda: list(ledger.get_month(year_month)),
+            get_total_report=ledger.get_total_report,
+            render=lambda: report.render(year_month, ledger, 'default_report.j2'),
+            render_year=lambda: ''.join(report.generate_range(
+                last_year + '-01-01', last_year + '-12-31', ledger, 'default_range_report.j2')),
+        )
+    return ops
+
+
+def run(ledger_types, years_list, number, repeat):
+    results = []
+    for years in years_list:
+        days = sum(1 for _ in synthetic.workdays(years))
+        for ledger_type in ledger_types:
+            with tempfile.TemporaryDirectory() as work_dir:
+                ledger = create_ledger(ledger_type, years, work_dir)
+                ledger.in_signal()  # today's record exists for the read operations
+
+                for name, op in operations(ledger).items():
+                    timings = [t / number * 1e6 for t in timeit.repeat(op, number=number, repeat=repeat)]
+                    result = dict(ledger=ledger_type, years=years, days=days, operation=name, calls=number * repeat,
+                                  min_us=round(min(timings), 1), median_us=round(statistics.median(timings), 1))
+                    results.append(result)
+                    print('{ledger:>14} {years:>3}y {operation:>17} {min_us:>12.1f} {median_us:>12.1f}'.format(**result))
+
+                ledger.close()
+
+    return results
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as fd:
+        baseline = {(r['ledger'], r['years'], r['operation']): r for r in json.load(fd)['results']}
+
+    print('\nCompared to {}'.format(baseline_file))
+    for r in results:
+        before = baseline.get((r['ledger'], r['years'], r['operation']))
+        if before and before['median_us']:
+            ratio = r['median_us'] / before['median_us']
+            print('{:>14} {:>3}y {:>17} {:>8.2f}x{}'.format(
+                r['ledger'], r['years'], r['operation'], ratio, '  <-- slower' if ratio > 1.25 else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--ledgers', nargs='+', default=LEDGER_TYPES, choices=LEDGER_TYPES)
+    parser.add_argument('--years', nargs='+', type=int, default=[1, 5, 20])
+    parser.add_argument('--number', type=int, default=20, help='calls per timing')
+    parser.add_argument('--repeat', type=int, default=5, help='timings per operation')
+    parser.add_argument('--output', default='bench_results.json', help='JSON results file')
+    parser.add_argument('--compare', metavar='BASELINE', help='earlier results file to compare with')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print('{:>14} {:>4} {:>17} {:>12} {:>12}'.format('ledger', 'hist', 'operation', 'min (us)', 'median (us)'))
+    results = run(args.ledgers, args.years, args.number, args.repeat)
+
+    try:
+        from importlib.metadata import version
+        bundyclock_version = version('bundyclock')
+    except Exception:
+        bundyclock_version = 'unknown'
+
+    with open(args.output, 'w') as fd:
+        json.dump(dict(
+            meta=dict(bundyclock=bundyclock_version, python=platform.python_version(),
+                      platform=platform.platform(), date=datetime.datetime.now().isoformat(timespec='seconds'),
+                      number=args.number, repeat=args.repeat),
+            results=results,
+        ), fd, indent=2)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
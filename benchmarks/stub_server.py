@@ -0,0 +1,99 @@
+"""
+In-memory stand-in for the REST API used by BundyHttpRest, for benchmarks.
+
+Serves <prefix>workdays/ (list with start_date/end_date filters, POST of
+one workday or a JSON list),
+<prefix>workdays/<date>/ (GET, PUT) and <prefix>workdays/total_sum/.
+"""
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+def _secs(hms):
+    h, m, s = map(int, hms.split(':'))
+    return h * 3600 + m * 60 + s
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _form(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return dict(parse_qsl(self.rfile.read(length).decode()))
+
+    def _route(self):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        item = parts[-1] if parts and parts[-1] != 'workdays' else None
+        return item, dict(parse_qsl(url.query))
+
+    def do_GET(self):
+        records = self.server.records
+        item, query = self._route()
+        if item == 'total_sum' or item is None:
+            with self.server.lock:
+                workdays = [w for day, w in records.items()
+                            if query.get('start_date', '') <= day <= query.get('end_date', '9999')]
+            if item is None:
+                return self._reply(200, workdays)
+            return self._reply(200, {'total_sum': {
+                'total_day': sum(_secs(w['total']) for w in workdays),
+                'total_break': sum(w.get('break_secs', 0) for w in workdays),
+            }})
+
+        with self.server.lock:
+            workday = records.get(item)
+        if workday is None:
+            return self._reply(404, {'detail': 'Not found.'})
+        self._reply(200, workday)
+
+    def do_POST(self):
+        bulk = self.headers.get('Content-Type') == 'application/json'
+        if bulk:
+            length = int(self.headers.get('Content-Length', 0))
+            workdays = json.loads(self.rfile.read(length))
+        else:
+            workdays = [self._form()]
+            workdays[0]['total'] = '00:00:00'
+        with self.server.lock:
+            for workday in workdays:
+                workday.update(num_breaks=0, break_secs=0)
+                self.server.records[workday['date']] = workday
+        self._reply(201, workdays if bulk else workdays[0])
+
+    def do_PUT(self):
+        item, _ = self._route()
+        workday = self._form()
+        delta = _secs(workday['outtime']) - _secs(workday['intime'])
+        workday['total'] = '%02d:%02d:%02d' % (delta // 3600, delta % 3600 // 60, delta % 60)
+        with self.server.lock:
+            stored = self.server.records.get(item, {})
+            workday.update(num_breaks=stored.get('num_breaks', 0), break_secs=stored.get('break_secs', 0))
+            self.server.records[item] = workday
+        self._reply(200, workday)
+
+
+def start(records=None):
+    """ serve records ({date: workday}) on a free local port, returns (server, base_url) """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.records = records if records is not None else {}
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, 'http://127.0.0.1:{}/bundyclock/api/workdays/'.format(server.server_address[1])
@@ -0,0 +1,100 @@
+"""
+Synthetic ledger history for the benchmarks.
+
+Workdays are generated for every weekday up to yesterday, with arrival
+and leave times, zero to three breaks and the occasional note, and are
+written straight in each ledger's storage format.
+"""
+import datetime
+import json
+import random
+import sqlite3
+
+
+def _hms(seconds):
+    return '%02d:%02d:%02d' % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def workdays(years, seed=0):
+    """
+    Yield dicts with day (datetime.date), intime, outtime, total,
+    breaks [(start, end)] and notes [str] for `years` years ending yesterday
+    """
+    rnd = random.Random(seed)
+    day = datetime.date.today() - datetime.timedelta(days=int(years * 365.25))
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+
+    while day <= yesterday:
+        if day.weekday() < 5:
+            t_in = rnd.randint(7 * 3600, 9 * 3600 + 1800)
+            t_out = t_in + rnd.randint(6 * 3600, 10 * 3600)
+
+            breaks = []
+            start = t_in + 3600
+            for _ in range(rnd.choice((0, 1, 1, 2, 3))):
+                start += rnd.randint(1800, 3 * 3600)
+                end = start + rnd.randint(300, 3600)
+                if end >= t_out:
+                    break
+                breaks.append((_hms(start), _hms(end)))
+                start = end
+
+            notes = ['project {}'.format(rnd.randint(1, 20))] if rnd.random() < 0.2 else []
+
+            yield dict(day=day, intime=_hms(t_in), outtime=_hms(t_out), total=_hms(t_out - t_in),
+                       breaks=breaks, notes=notes)
+
+        day += datetime.timedelta(days=1)
+
+
+def write_text(filename, years):
+    with open(filename, 'w') as fd:
+        for w in workdays(years):
+            fd.write('{} - In: {} Out: {} Total: {}\n'.format(
+                w['day'].strftime('%Y.%m.%d'), w['intime'], w['outtime'], w['total']))
+
+
+def write_json(filename, years):
+    my_times = {w['day'].strftime('%Y.%m.%d - %a'): {'in': w['intime'], 'out': w['outtime'], 'total': w['total']}
+                for w in workdays(years)}
+    with open(filename, 'w') as fd:
+        json.dump(my_times, fd, indent=2, sort_keys=True)
+
+
+def write_jsonl(filename, years):
+    with open(filename, 'w') as fd:
+        for w in workdays(years):
+            fd.write(json.dumps({'day': w['day'].strftime('%Y.%m.%d - %a'),
+                                 'in': w['intime'], 'out': w['outtime'], 'total': w['total']},
+                                sort_keys=True) + '\n')
+
+
+def write_sqlite(filename, years, ledger_class):
+    """ ledger_class creates the schema, the history is inserted in one transaction """
+    ledger_class(filename).close()
+
+    db = sqlite3.connect(filename)
+    for w in workdays(years):
+        day = w['day'].isoformat()
+        db.execute('INSERT INTO workdays (day, intime, outtime, total) VALUES (?,?,?,?)',
+                   (day, w['intime'], w['outtime'], w['total']))
+        db.executemany('INSERT INTO breaks (day, start, end) VALUES (?,?,?)',
+                       [(day, start, end) for start, end in w['breaks']])
+        db.executemany('INSERT INTO notes (day, note) VALUES (?,?)', [(day, note) for note in w['notes']])
+    db.commit()
+    db.close()
+
+
+def http_records(years):
+    """ workday records as served by the REST API, keyed by date """
+    records = {}
+    for w in workdays(years):
+        break_secs = sum(_secs(end) - _secs(start) for start, end in w['breaks'])
+        records[w['day'].isoformat()] = dict(date=w['day'].isoformat(), intime=w['intime'], outtime=w['outtime'],
+                                             total=w['total'], num_breaks=len(w['breaks']), break_secs=break_secs)
+    return records
+
+
+def _secs(hms):
+    h, m, s = map(int, hms.split(':'))
+    return h * 3600 + m * 60 + s
@@ -14,42 +14,70 @@ import configparser
 import contextlib
 import logging
 
-from dateutil.parser import parse as guess_date
-from pkg_resources import resource_string
 from subprocess import Popen, PIPE
 from time import strftime
 from sys import platform
 
 import bundyclock
-if platform == "linux" or platform == "linux2":
-    # linux
-    from .lockscreen import LinuxStrategy as Strategy
-elif platform == "darwin":
-    from .cocoaevent import LockScreen as Strategy
-    # OS X
-elif platform == "win32":
-    # Windows
-    from .wmilockscreen import LockScreen as Strategy
-
 from .ledgers.factory import get_ledger as ledger_factory
-from . import report
-from .platformctx import PlatformCtx
+
+# Everything else is imported by the subcommand needing it, so that a plain
+# punch doesn't pay for loading the GUI, report and date parsing libraries.
 
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_CONTROL_SOCKET = 'bundyclock.sock'
 
 CONFIG = """[bundyclock]
-# ledger_type, choose from (text, json, sqlite, http-rest)
+# ledger_type, choose from (text, json, jsonl, sqlite, sqlite-events, http-rest).
+# Several, comma separated, all get every punch, e.g. sqlite,http-rest keeps a local
+# copy of a REST ledger. Reads wait sink_timeout seconds for a local ledger,
+# http_timeout for http-rest, before trying the next one
 ledger_type = sqlite
+# sink_timeout = 5
 ledger_file = in_out_times.db
+# sqlite ledgers: when punches reach the disk, choose from (event, interval, exit).
+# interval writes at most every flush_interval seconds, exit only on shutdown and reports
+# durability = event
+# flush_interval = 30
+
+# the daemon serves CLI invocations on this UNIX socket, leave empty to disable
+control_socket = bundyclock.sock
 
 # logging, default is to stdout. Uncomment to log to file
 # log_file = bundyclock.log
 
+# linux: where lock and unlock events come from, comma separated, choose from
+# (screensaver, logind, replay:FILE). replay punches recorded events from FILE, - for stdin,
+# and stops the daemon at its end. Turn off systray to run the daemon without a desktop
+# event_sources = screensaver
+# systray = yes
+
+# lock screen debouncing: a lock is written once the screen has stayed locked for
+# min_away seconds, an unlock once the screen wasn't locked again within coalesce_window
+# seconds, shorter absences aren't written. 0 writes every event at once
+# min_away = 60
+# coalesce_window = 5
+
+# daemon metrics in Prometheus text format, written to a file every metrics_interval
+# seconds and/or served on a UNIX socket. Uncomment to enable
+# metrics_file = metrics.prom
+# metrics_socket = metrics.sock
+# metrics_interval = 15
+
 # jinja2 report template used with --report option
 template = default_report.j2
+# and for reports over several months, e.g. --report 2024-01..2024-06 or --report 2024
+range_template = default_range_report.j2
+# cache compiled report templates on disk, uncomment to enable
+# template_cache = template_cache
+# worked time a day that the stats subcommand counts overtime against
+# daily_target = 08:00:00
 url = http://localhost:8000/bundyclock/api/workdays/
+# http-rest punches are queued here until the server can be reached
+# outbox_file = http_outbox.db
+# http_timeout = 5
 
 """
 
@@ -73,6 +101,42 @@ def setup_file_logger(log_file):
     rootLogger.addHandler(fileHandler)
 
 
+def get_strategy():
+    """ punch strategy of this platform """
+    if platform == "linux" or platform == "linux2":
+        # linux
+        from .lockscreen import LinuxStrategy as Strategy
+    elif platform == "darwin":
+        from .cocoaevent import LockScreen as Strategy
+        # OS X
+    elif platform == "win32":
+        # Windows
+        from .wmilockscreen import LockScreen as Strategy
+
+    return Strategy
+
+
+def via_daemon(settings, command, **kwargs):
+    """
+    Let a running daemon serve the command, its output is written to stdout.
+    Returns False if no daemon is listening on the control socket.
+    """
+    control_socket = settings.get('control_socket', DEFAULT_CONTROL_SOCKET)
+    if not control_socket:
+        return False
+
+    from .control import ControlClient, DaemonError, DaemonUnavailable
+    try:
+        for chunk in ControlClient(control_socket).request(command, **kwargs):
+            sys.stdout.write(chunk)
+    except DaemonUnavailable:
+        return False
+    except DaemonError as e:
+        sys.exit('\t{}'.format(e))
+
+    return True
+
+
 def main():
     """
     bundyclock CLI
@@ -87,8 +151,9 @@ def main():
     parser.add_argument('-d', '--daemon',
                         help='start daemon mode',
                         action='store_true')
-    parser.add_argument('--report', nargs='?', metavar='YYYY-MM',
-                        help='Generate monthly report', const=strftime('%Y-%m'))
+    parser.add_argument('--report', nargs='?', metavar='YYYY-MM[..YYYY-MM] | YYYY',
+                        help='Generate monthly report, or a report over a range of months or a year',
+                        const=strftime('%Y-%m'))
     parser.add_argument('--config', nargs=1, metavar='CONFIG_FILE',
                         help='alternative configuration', default=['~/.bundyclock/bundyclock.cfg'])
 
@@ -97,6 +162,20 @@ def main():
     parser_notes.add_argument('note', nargs=1, help='note to add', type=str)
     parser_notes.add_argument('--date', '-d', action='store', metavar='YYYY-MM-DD',
                               help='date of note', default=strftime('%Y-%m-%d'))
+    parser_convert = subparsers.add_parser('convert', help='copy the history from one ledger to another')
+    parser_convert.add_argument('--from', dest='source', required=True, metavar='TYPE:FILE',
+                                help='ledger to read, text, json, jsonl or sqlite, e.g. text:in_out_times.txt')
+    parser_convert.add_argument('--to', dest='target', required=True, metavar='TYPE:FILE|URL',
+                                help='ledger to write, text, jsonl, sqlite or http-rest, e.g. sqlite:in_out_times.db')
+    parser_convert.add_argument('--batch-size', type=int, help='workdays per transaction or request')
+    parser_migrate = subparsers.add_parser('migrate', help='upgrade the schema of a sqlite ledger')
+    parser_migrate.add_argument('--dry-run', action='store_true',
+                                help='run the pending migrations and roll them back')
+    parser_stats = subparsers.add_parser('stats', help='arrival, leave, worked hours, overtime and break statistics')
+    parser_stats.add_argument('period', nargs='?', metavar='YYYY-MM[..YYYY-MM] | YYYY',
+                              help='months to include, default is the whole history')
+    parser_stats.add_argument('--target', metavar='HH:MM:SS',
+                              help='worked time a day to count overtime against, default from config or 08:00:00')
 
 
     args = parser.parse_args()
@@ -112,7 +191,8 @@ def main():
             logger.info('Creating systemd user dir')
             os.mkdir(sysd_user_dir)
 
-        service_file = resource_string(__name__, 'service_files/bundyclock.service')
+        from importlib.resources import files
+        service_file = files(__package__).joinpath('service_files/bundyclock.service').read_bytes()
 
         with open(os.path.join(sysd_user_dir, 'bundyclock.service'), 'wb+') as s:
             s.write(service_file)
@@ -147,11 +227,22 @@ def main():
         if log_file_name:
             setup_file_logger(log_file=log_file_name)
 
+        settings = config._sections['bundyclock']
+
         if args.subcommand == 'note':
-            ledger = ledger_factory(**config._sections['bundyclock'])
-            ledger.add_note(args.note[0], guess_date(args.date).strftime('%Y-%m-%d'))
+            from dateutil.parser import parse as guess_date
+            date = guess_date(args.date).strftime('%Y-%m-%d')
+            if not via_daemon(settings, 'note', note=args.note[0], date=date):
+                ledger = ledger_factory(**settings)
+                ledger.add_note(args.note[0], date)
+                # written before the work dir is left, ledger files are relative to it
+                ledger.close()
 
         if args.daemon:
+            from . import metrics
+            from .control import ControlServer
+            from .platformctx import PlatformCtx
+
             try:
                 is_gui = not sys.stdin.isatty()
             except AttributeError:
@@ -159,21 +250,107 @@ def main():
             logger.info("Starting bundyclock daemon in {mode} mode"
                         .format(mode="GUI" if is_gui else "terminal"))
 
-            ctx = PlatformCtx(Strategy(**config._sections['bundyclock']))
+            exporters = metrics.start_exporters(metrics_file=settings.get('metrics_file'),
+                                                metrics_socket=settings.get('metrics_socket'),
+                                                interval=float(settings.get('metrics_interval', 15)))
+
+            try:
+                strategy = get_strategy()(**settings)
+            except ValueError as e:
+                sys.exit('\t{}'.format(e))
+            control_socket = settings.get('control_socket', DEFAULT_CONTROL_SOCKET)
+            if control_socket:
+                try:
+                    exporters.append(ControlServer(control_socket, strategy.ledger, settings))
+                except OSError as e:
+                    logger.warning("Control socket disabled: {}".format(e))
+
+            ctx = PlatformCtx(strategy)
             ctx.run()
 
+            for exporter in exporters:
+                exporter.stop()
+
         elif args.report:
-            ledger = ledger_factory(**config._sections['bundyclock'])
-            if ledger.can_report:
-                year_month = guess_date(args.report).strftime('%Y-%m')
-                print(report.render(year_month, ledger, config.get('bundyclock', 'template')))
+            if not via_daemon(settings, 'report', period=args.report):
+                from . import report
+                ledger = ledger_factory(**settings)
+                if ledger.can_report:
+                    try:
+                        chunks = report.generate_period(args.report, ledger, settings)
+                    except ValueError as e:
+                        sys.exit('\t{}'.format(e))
+                    for chunk in chunks:
+                        sys.stdout.write(chunk)
+                    print()
+                else:
+                    sys.exit('\t--report not supported by "{}" ledger type'.format(settings.get('ledger_type')))
+
+        elif args.subcommand == 'convert':
+            import sqlite3
+            import requests
+            from . import convert
+            try:
+                count = convert.convert(args.source, args.target, args.batch_size, settings)
+            except (ValueError, IOError, sqlite3.Error, requests.exceptions.RequestException) as e:
+                sys.exit('\t{}'.format(e))
+            print('Copied {} workdays from {} to {}'.format(count, args.source, args.target))
+
+        elif args.subcommand == 'migrate':
+            import sqlite3
+            from .ledgers import migrations
+            if 'sqlite' not in settings.get('ledger_type'):
+                sys.exit('\tmigrate not supported by "{}" ledger type'.format(settings.get('ledger_type')))
+
+            def progress(migration, step, steps, changes, seconds):
+                print('[{}/{}] version {:>2} {:<36} {:>8} rows {:>8.2f} s'.format(
+                    step, steps, migration.version, migration.description, changes, seconds))
+
+            db = sqlite3.connect('{}.db'.format(settings.get('ledger_file').split('.')[0]))
+            print('Schema version {}'.format(migrations.current_version(db)))
+            applied = migrations.migrate(db, dry_run=args.dry_run, progress=progress)
+            if not applied:
+                print('Up to date')
+            elif args.dry_run:
+                print('Dry run, rolled back')
+            db.close()
+
+        elif args.subcommand == 'stats':
+            try:
+                from . import stats
+            except ImportError as e:
+                if e.name != 'numpy':
+                    raise
+                sys.exit('\tstats needs numpy, pip install bundyclock[stats]')
+            from .ledgers.ledgers import hms_to_seconds
+            ledger = ledger_factory(**settings)
+            if not ledger.can_report:
+                sys.exit('\tstats not supported by "{}" ledger type'.format(settings.get('ledger_type')))
+
+            if args.period:
+                from . import report
+                try:
+                    start_date, end_date = report.period_dates(args.period)
+                except ValueError as e:
+                    sys.exit('\t{}'.format(e))
             else:
-                sys.exit('\t--report not supported by "{}" ledger type'.format(config.get('bundyclock', 'ledger_type')))
+                start_date, end_date = '0001-01-01', '9999-12-31'
+            try:
+                target = hms_to_seconds(args.target or settings.get('daily_target', '08:00:00'))
+            except ValueError:
+                sys.exit('\tExpected the target as HH:MM:SS')
+
+            try:
+                text = stats.generate(start_date, end_date, ledger, target)
+            except IOError as e:
+                sys.exit('\t{}'.format(e))
+            print(text or 'No workdays between {} and {}'.format(start_date, end_date))
 
-        else:
-            ledger = ledger_factory(**config._sections['bundyclock'])
+        elif not via_daemon(settings, 'punch'):
+            ledger = ledger_factory(**settings)
             ledger.out_signal()
             print(ledger.get_today())
+            ledger.close()
 
 
 if __name__ == "__main__":
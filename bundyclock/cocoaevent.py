@@ -1,8 +1,8 @@
 import Foundation
 from AppKit import NSObject
 from PyObjCTools import AppHelper
+from . import metrics
 from .platformctx import PunchStrategy
-from .ledgers.factory import get_ledger as ledger_factory
 from .systrayapp import SystrayApp
 
 import logging
@@ -15,25 +15,27 @@ class GetScreensaver(NSObject):
 
     def screenIsLocked_(self, islocked):
         logger.debug('screenIsLocked')
+        metrics.EVENTS.inc(event='lock')
         self.ledger.out_signal()
 
     def screenIsUnlocked(self):
         logger.debug('screenIsUnLocked')
+        metrics.EVENTS.inc(event='unlock')
         self.ledger.in_signal()
 
 
 class LockScreen(PunchStrategy):
     def __init__(self, **kwargs):
         self.config = kwargs
-        self.ledger = ledger_factory(**self.config)
+        self._setup_punches(punch_in=False)
 
         self.nc = Foundation.NSDistributedNotificationCenter.defaultCenter()
         self.get_screensaver = GetScreensaver.new()
-        self.get_screensaver.ledger = self.ledger
+        self.get_screensaver.ledger = self.punches
         self.nc.addObserver_selector_name_object_(self.get_screensaver, 'screenIsLocked:', 'com.apple.screenIsLocked', None)
         self.nc.addObserver_selector_name_object_(self.get_screensaver, 'screenIsUnlocked', 'com.apple.screenIsUnlocked', None)
 
-        self.app = SystrayApp(ledger=self.ledger, actioncb=self.action)
+        self.app = SystrayApp(ledger=self.punches, actioncb=self.action, today=self.today)
 
     def action(self, query):
         if query == 'quit':
@@ -41,9 +43,12 @@ class LockScreen(PunchStrategy):
 
     def run(self):
         self.app.run_detached()
+        self.app.start_ticking()
         try:
             logger.info('Starting eventloop')
             AppHelper.runEventLoop()
         except KeyboardInterrupt:
-            self.ledger.out_signal()
+            self.punches.out_signal()
             logger.exception("KeyboardInterrrupt, shutting down")
+        self.punches.flush()
+        self.ledger.close()
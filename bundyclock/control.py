@@ -0,0 +1,151 @@
+"""
+Control socket of the daemon, lets CLI invocations use the daemon's open
+ledger instead of constructing their own.
+
+A request is one JSON line {"command": ..., <arguments>}. The reply is a
+JSON status line, {"status": "ok"} or {"status": "error", "message": ...},
+followed by the command's text output until the connection is closed.
+"""
+import codecs
+import itertools
+import json
+import os
+import socket
+import socketserver
+import threading
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DaemonUnavailable(Exception):
+    """ no daemon is listening on the control socket """
+
+
+class DaemonError(Exception):
+    """ the daemon failed to serve the request """
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            command = getattr(self.server.control, 'do_' + request.pop('command'))
+            chunks = iter(command(**request))
+            # pull the first chunk so that errors are reported in the status line
+            first = next(chunks, '')
+        except Exception as e:
+            logger.exception("Control request failed")
+            self._write_line(dict(status='error', message=str(e) or type(e).__name__))
+            return
+
+        self._write_line(dict(status='ok'))
+        try:
+            self.wfile.write(first.encode())
+            for chunk in chunks:
+                self.wfile.write(chunk.encode())
+        except Exception:
+            logger.exception("Control request failed while streaming the reply")
+
+    def _write_line(self, obj):
+        self.wfile.write(json.dumps(obj).encode() + b'\n')
+
+
+class ControlServer(object):
+    """
+    Serves punch, note, today and report requests on a UNIX socket, with the
+    ledger of the running daemon
+    """
+    def __init__(self, path, ledger, settings):
+        self.path = path
+        self.ledger = ledger
+        self.settings = settings
+
+        if not hasattr(socketserver, 'UnixStreamServer'):
+            raise OSError('UNIX sockets not supported')
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = socketserver.ThreadingUnixStreamServer(path, _ControlHandler, bind_and_activate=False)
+        self._server.daemon_threads = True
+        self._server.control = self
+        self._server.server_bind()
+        # only the user may punch, no one can connect before the socket listens
+        os.chmod(path, 0o600)
+        self._server.server_activate()
+
+        self._thread = threading.Thread(target=self._server.serve_forever, name='bundyclock-control', daemon=True)
+        self._thread.start()
+        logger.info("Serving CLI requests on {}".format(path))
+
+    def do_punch(self):
+        self.ledger.out_signal()
+        return self.do_today()
+
+    def do_note(self, note, date):
+        self.ledger.add_note(note, date)
+        return []
+
+    def do_today(self):
+        today = self.ledger.get_today()
+        return ['{}\n'.format(today if today is not None else 'No punches today')]
+
+    def do_report(self, period):
+        from . import report
+
+        if not self.ledger.can_report:
+            raise DaemonError('--report not supported by "{}" ledger type'.format(self.settings.get('ledger_type')))
+        return itertools.chain(report.generate_period(period, self.ledger, self.settings), '\n')
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        os.unlink(self.path)
+
+
+class ControlClient(object):
+    """ Sends requests to the ControlServer of a running daemon """
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+
+    def request(self, command, **kwargs):
+        """
+        send command, yields the text output. Raises DaemonUnavailable if no
+        daemon is listening or it doesn't answer, and DaemonError if the
+        daemon failed the request
+        """
+        if not hasattr(socket, 'AF_UNIX'):
+            raise DaemonUnavailable('UNIX sockets not supported')
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            # not there, not ours or hung
+            sock.close()
+            raise DaemonUnavailable(str(e) or type(e).__name__)
+
+        return self._reply(sock, dict(kwargs, command=command))
+
+    @staticmethod
+    def _reply(sock, request):
+        with sock, sock.makefile('rb') as reply:
+            try:
+                sock.sendall(json.dumps(request).encode() + b'\n')
+                status = json.loads(reply.readline() or b'{"status": "error", "message": "no reply from daemon"}')
+            except OSError as e:
+                # nothing written yet, the ledger can serve the request instead
+                raise DaemonUnavailable('No reply from daemon: {}'.format(str(e) or type(e).__name__))
+            if status['status'] != 'ok':
+                raise DaemonError(status.get('message'))
+
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            try:
+                for chunk in iter(lambda: reply.read1(65536), b''):
+                    yield decoder.decode(chunk)
+            except OSError as e:
+                raise DaemonError('Daemon stopped replying: {}'.format(str(e) or type(e).__name__))
+            yield decoder.decode(b'', final=True)
@@ -0,0 +1,178 @@
+"""
+Copy the workday history from one ledger to another.
+
+Records are streamed from the source through generators and written in
+batches, so memory use doesn't grow with the length of the history. A
+ledger is given as TYPE:LOCATION, e.g. text:in_out_times.txt,
+sqlite:in_out_times.db or http-rest:https://example.com/bundyclock/api/workdays/
+"""
+import datetime
+import json
+import sqlite3
+
+from functools import partial
+from itertools import groupby, islice
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ('text', 'json', 'jsonl', 'sqlite')
+TARGETS = ('text', 'jsonl', 'sqlite', 'http-rest')
+
+
+def parse_ledger_spec(spec, choices):
+    """ (ledger_type, location) of a TYPE:LOCATION argument """
+    ledger_type, sep, location = spec.partition(':')
+    if not sep or not location:
+        raise ValueError('Expected TYPE:LOCATION, got "{}"'.format(spec))
+    if ledger_type not in choices:
+        raise ValueError('Ledger type "{}" not supported here, choose from ({})'.format(
+            ledger_type, ', '.join(choices)))
+    return ledger_type, location
+
+
+def _workday(day, intime, outtime, total):
+    """ day in YYYY-MM-DD from any of the ledgers' day formats """
+    return dict(day=day[:10].replace('.', '-'), intime=intime, outtime=outtime, total=total)
+
+
+def read_text(filename):
+    from .ledgers.ledgers import TextOutput
+
+    with open(filename) as fd:
+        for line in fd:
+            r = TextOutput.RECORD.match(line)
+            if r:
+                yield _workday(r['day'], r['in'], r['out'], r['total'])
+
+
+def read_json(filename):
+    # a single JSON object, can't be read piecewise
+    with open(filename) as fd:
+        my_times = json.load(fd)
+
+    for key in sorted(my_times):
+        record = my_times[key]
+        yield _workday(key, record['in'], record['out'], record['total'])
+
+
+def read_jsonl(filename):
+    def records():
+        with open(filename) as fd:
+            for line in fd:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    # a day not yet compacted has several records, the last one is current
+    for _, day_records in groupby(records(), key=lambda record: record['day']):
+        for record in day_records:
+            pass
+        yield _workday(record['day'], record['in'], record['out'], record['total'])
+
+
+def read_sqlite(filename):
+    db = sqlite3.connect('file:{}?mode=ro'.format(filename), uri=True)
+    try:
+        yield from (_workday(*row) for row in db.execute(
+            'SELECT day, intime, outtime, total FROM workdays ORDER BY day'))
+    finally:
+        db.close()
+
+
+def batched(iterable, size):
+    """ lists of up to size items from iterable """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_text(filename, workdays, batch_size):
+    count = 0
+    with open(filename, 'a') as fd:
+        for batch in batched(workdays, batch_size):
+            fd.writelines('{} - In: {} Out: {} Total: {}\n'.format(
+                w['day'].replace('-', '.'), w['intime'], w['outtime'], w['total']) for w in batch)
+            count += len(batch)
+    return count
+
+
+def write_jsonl(filename, workdays, batch_size):
+    def line(w):
+        day = datetime.date.fromisoformat(w['day']).strftime('%Y.%m.%d - %a')
+        return json.dumps({'day': day, 'in': w['intime'], 'out': w['outtime'], 'total': w['total']},
+                          sort_keys=True) + '\n'
+
+    count = 0
+    with open(filename, 'a') as fd:
+        for batch in batched(workdays, batch_size):
+            fd.writelines(line(w) for w in batch)
+            count += len(batch)
+    return count
+
+
+def write_sqlite(filename, workdays, batch_size):
+    from .ledgers.dbledger import SqLiteOutput
+
+    # creates or upgrades the schema
+    ledger = SqLiteOutput(filename)
+    count = 0
+    try:
+        for batch in batched(workdays, batch_size):
+            with ledger.db:
+                ledger.db.executemany(
+                    '''
+                    INSERT INTO workdays (day, intime, outtime, total) VALUES (:day, :intime, :outtime, :total)
+                    ON CONFLICT(day) DO UPDATE
+                    SET intime = excluded.intime, outtime = excluded.outtime, total = excluded.total
+                    ''', batch)
+            count += len(batch)
+    finally:
+        ledger.close()
+    return count
+
+
+def write_http_rest(url, workdays, batch_size, outbox_file='http_outbox.db', timeout=5.0):
+    from .ledgers.httpledger import BundyHttpRest
+
+    ledger = BundyHttpRest(url, outbox_file=outbox_file, timeout=timeout)
+    count = 0
+    try:
+        for batch in batched(workdays, batch_size):
+            ledger.send_workdays(batch)
+            count += len(batch)
+    finally:
+        ledger.close()
+    return count
+
+
+READERS = dict(text=read_text, json=read_json, jsonl=read_jsonl, sqlite=read_sqlite)
+WRITERS = {'text': write_text, 'jsonl': write_jsonl, 'sqlite': write_sqlite, 'http-rest': write_http_rest}
+
+
+def convert(source, target, batch_size=None, settings=None):
+    """
+    Copy all workdays from source to target, both TYPE:LOCATION specs, and
+    return the number of days copied. Days already in a sqlite or http-rest
+    target are overwritten, text and jsonl targets are appended to.
+    settings is the bundyclock config section, for the http-rest options.
+    """
+    source_type, source_location = parse_ledger_spec(source, SOURCES)
+    target_type, target_location = parse_ledger_spec(target, TARGETS)
+    if batch_size is None:
+        # one request per batch for http-rest, one transaction or write per batch for the rest
+        batch_size = 100 if target_type == 'http-rest' else 10000
+
+    writer = WRITERS[target_type]
+    if target_type == 'http-rest':
+        settings = settings or {}
+        writer = partial(writer, outbox_file=settings.get('outbox_file', 'http_outbox.db'),
+                         timeout=float(settings.get('http_timeout', 5)))
+
+    logger.info("Converting {} to {}".format(source, target))
+    return writer(target_location, READERS[source_type](source_location), batch_size)
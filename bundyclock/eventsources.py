@@ -0,0 +1,151 @@
+"""
+Event sources turn lock screen, session and sleep events into punches.
+
+A source is given by name, with an argument after a colon where it takes
+one, e.g. screensaver, logind or replay:events.txt. The D-Bus sources run
+on a GLib main loop, the others on a plain thread.
+"""
+import datetime
+import sys
+import threading
+import time
+
+from . import metrics
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ('screensaver', 'logind', 'replay')
+
+
+def get_source(spec, punches, done=None):
+    """ event source of a NAME[:ARG] spec, done is called by sources that end """
+    # D-Bus sources are imported on demand, a replay doesn't need a desktop
+    name, _, arg = spec.strip().partition(':')
+    if name == 'screensaver':
+        from .lockscreen import LockScreen
+        return LockScreen(punches)
+    elif name == 'logind':
+        from .lockscreen import LogindSession
+        return LogindSession(punches)
+    elif name == 'replay':
+        return ReplaySource(punches, arg or '-', done)
+
+    raise ValueError('Event source "{}" not supported, choose from ({})'.format(name, ', '.join(SOURCES)))
+
+
+class EventSource(object):
+    """ Base class of event sources, every event goes through locked() or unlocked() """
+    uses_dbus = False
+
+    def __init__(self, punches):
+        self.punches = punches
+
+    def locked(self, handler, now=None):
+        """ the screen was locked at now, or just now """
+        with metrics.HANDLER_SECONDS.time(handler=handler):
+            logger.debug('{}: lock screen'.format(handler))
+            metrics.EVENTS.inc(event='lock')
+            self.punches.out_signal(now=now)
+
+    def unlocked(self, handler, now=None):
+        with metrics.HANDLER_SECONDS.time(handler=handler):
+            logger.debug('{}: unlock screen'.format(handler))
+            metrics.EVENTS.inc(event='unlock')
+            self.punches.in_signal(now=now)
+
+    def start(self):
+        """ Start delivering events, without blocking """
+        pass
+
+    def stop(self):
+        pass
+
+
+class ReplaySource(EventSource):
+    """
+    Events read from a file, or stdin for '-', one per line. The event is the
+    last word of a line, optionally after its time in ISO 8601 or seconds
+    since the epoch, so recorded logs like '2024-05-02T08:01:13 unlock' can
+    be replayed as they are and are punched at the recorded time. Events are
+    handled as fast as they are read, at the end of the stream done is called.
+    """
+    LOCKED = ('lock', 'sleep')
+    UNLOCKED = ('unlock', 'wake')
+
+    def __init__(self, punches, filename='-', done=None):
+        super().__init__(punches)
+        self.filename = filename
+        self.done = done
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._replay, name='bundyclock-replay', daemon=True)
+        self._thread.start()
+
+    def _replay(self):
+        fd = sys.stdin if self.filename == '-' else open(self.filename)
+        count = 0
+        start = time.perf_counter()
+        try:
+            for line in fd:
+                if self._stopped.is_set():
+                    break
+                words = line.split()
+                if not words or words[0].startswith('#'):
+                    continue
+
+                event = words[-1]
+                try:
+                    now = self._parse_time(words[0]) if len(words) > 1 else None
+                except ValueError:
+                    logger.warning('Unknown time "{}" in {}'.format(words[0], self.filename))
+                    continue
+
+                if event in self.LOCKED:
+                    self.locked('replay', now)
+                elif event in self.UNLOCKED:
+                    self.unlocked('replay', now)
+                elif event == 'break':
+                    metrics.EVENTS.inc(event='take a break')
+                    self.punches.take_a_break(now=now)
+                else:
+                    logger.warning('Unknown event "{}" in {}'.format(event, self.filename))
+                    continue
+                count += 1
+        finally:
+            if fd is not sys.stdin:
+                fd.close()
+
+        elapsed = time.perf_counter() - start
+        logger.info('Replayed {} events in {:.2f} s, {:.0f} events/s'.format(
+            count, elapsed, count / elapsed if elapsed else 0))
+        if self.done and not self._stopped.is_set():
+            self.done()
+
+    @staticmethod
+    def _parse_time(word):
+        """ seconds since the epoch of a recorded time, local time unless it has an offset """
+        try:
+            return float(word)
+        except ValueError:
+            return datetime.datetime.fromisoformat(word).timestamp()
+
+    def stop(self):
+        self._stopped.set()
+
+
+class ThreadLoop(object):
+    """ Main loop when no source needs GLib, runs until quit() """
+    def __init__(self):
+        self._quit = threading.Event()
+
+    def run(self):
+        # wait in steps, so that KeyboardInterrupt gets through
+        while not self._quit.wait(1):
+            pass
+
+    def quit(self):
+        self._quit.set()
@@ -0,0 +1,96 @@
+import atexit
+import time
+
+from concurrent.futures import TimeoutError
+
+from .ledgers import BundyLedger
+from .worker import LedgerWorker
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CompositeLedger(BundyLedger):
+    """
+    Punches go to several ledgers, e.g. a local sqlite copy and a REST
+    backend. Every sink has its own worker thread, so a slow or failing sink
+    doesn't hold up or break the others. Writes are queued to all sinks at
+    once and return without waiting. Today comes from the first local sink,
+    reports from the first local sink that can report, the other sinks are
+    the fallback.
+    """
+
+    def __init__(self, sinks):
+        """ sinks is a list of (ledger, timeout), timeout in seconds to wait for the ledger's reads """
+        self.sinks = [(LedgerWorker(ledger, name='sink{}:{}'.format(i, type(ledger).__name__)), timeout)
+                      for i, (ledger, timeout) in enumerate(sinks)]
+        # local sinks first, a remote one is only asked when they fail
+        self.todays = sorted(self.sinks, key=lambda sink: sink[0].ledger.remote)
+        self.readers = [sink for sink in self.todays if sink[0].ledger.can_report]
+        self.can_report = bool(self.readers)
+        # the sink workers are daemon threads, don't lose queued punches when the CLI exits
+        atexit.register(self.close)
+
+    def _broadcast(self, name, *args, **kwargs):
+        for worker, _ in self.sinks:
+            if hasattr(worker.ledger, name):
+                worker.submit(name, *args, **kwargs)
+
+    def _read(self, sinks, name, *args, **kwargs):
+        for worker, timeout in sinks:
+            try:
+                return worker.submit(name, *args, **kwargs).result(timeout)
+            except TimeoutError:
+                logger.warning("{} {} timed out after {} s".format(type(worker.ledger).__name__, name, timeout))
+            except Exception as e:
+                logger.warning("{} {} failed: {}".format(type(worker.ledger).__name__, name, e))
+
+        raise RuntimeError("No ledger could answer {}".format(name))
+
+    # every sink gets the same time, however long its queue
+    def in_signal(self, now=None):
+        self._broadcast('in_signal', now=time.time() if now is None else now)
+
+    def out_signal(self, now=None):
+        self._broadcast('out_signal', now=time.time() if now is None else now)
+
+    def update_in_out(self, now=None):
+        self._broadcast('update_in_out', now=time.time() if now is None else now)
+
+    def take_a_break(self, now=None):
+        now = time.time() if now is None else now
+        for worker, _ in self.sinks:
+            # not every ledger records breaks
+            if type(worker.ledger).take_a_break is not BundyLedger.take_a_break:
+                worker.take_a_break(now=now)
+
+    def add_note(self, note, date):
+        self._broadcast('add_note', note, date)
+
+    def get_today(self):
+        return self._read(self.todays, 'get_today')
+
+    def get_month(self, month=None):
+        return self._read(self.readers, 'get_month', month)
+
+    def get_range(self, start_date, end_date):
+        return self._read(self.readers, 'get_range', start_date, end_date)
+
+    def get_total_report(self, start_date=None, end_date=None):
+        return self._read(self.readers, 'get_total_report', start_date, end_date)
+
+    def flush(self):
+        futures = [(worker.submit('flush'), worker, timeout) for worker, timeout in self.sinks]
+        for future, worker, timeout in futures:
+            try:
+                future.result(timeout)
+            except TimeoutError:
+                logger.warning("{} flush timed out after {} s".format(type(worker.ledger).__name__, timeout))
+            except Exception:
+                # logged by the worker
+                pass
+
+    def close(self):
+        for worker, _ in self.sinks:
+            worker.close()
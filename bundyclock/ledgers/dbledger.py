@@ -1,174 +1,151 @@
 import sqlite3
 import datetime
-import re
+import threading
 import time
 
-from .ledgers import BundyLedger, PunchTime
+from calendar import monthrange
+
+from . import migrations
+from .ledgers import BundyLedger, PunchTime, DURABILITY_EVENT
+from .. import metrics
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+# today's open break hasn't been looked up
+_UNKNOWN = object()
+
+
 class SqLiteOutput(BundyLedger):
     """
-
+    Today's workdays row and open break are kept in memory, so a punch is a
+    single write. The cache is dropped when the day changes or another
+    connection has committed to the database, as told by PRAGMA data_version.
     """
     can_report = True
 
-    def __init__(self, filename):
+    def __init__(self, filename, durability=DURABILITY_EVENT, flush_interval=30):
+        self.set_durability(durability, flush_interval)
+        # today's workdays row, changes are buffered here until flushed
+        self._today = None
+        self._dirty = False
+        # id of today's open break, None when there is none
+        self._open_break = _UNKNOWN
+        self._cached_day = None
+        self._data_version = None
+        self._lock = threading.RLock()
 
         db = sqlite3.connect(filename, check_same_thread=False)
         db.row_factory = sqlite3.Row  # Make sure we can access columns by name
 
-        db.executescript(
-            '''
-            CREATE TABLE IF NOT EXISTS workdays (
-                day TEXT UNIQUE,
-                intime TEXT,
-                outtime TEXT,
-                total TEXT
-            );
-            ''')
+        migrations.migrate(db)
 
         self.db = db
 
-        user_version = db.execute('PRAGMA user_version').fetchone()[0]
-        if user_version < 1:
-            user_version = self._migrate_00_01_date_format()
-
-        if user_version == 1:
-            user_version = self._migrate_01_02_create_breaks_table()
-
-        if user_version == 2:
-            user_version = self._migrate_02_03_create_notes_table()
-
-    def _migrate_00_01_date_format(self):
-        logger.info("Applying migration 'date format'")
-        NEXT_VERSION = 1
-
-        cur = self.db.execute('SELECT day from workdays')
-        updated_rows = 0
-        all_rows = cur.fetchall()
-        for day in all_rows:
-            dot_day = day[0]
-            try:
-                dash_day = datetime.datetime.strptime(dot_day, '%Y.%m.%d').strftime('%Y-%m-%d')
-                self.db.execute('UPDATE workdays SET day=? WHERE day=?', (dash_day, dot_day))
-                updated_rows += 1
-            except ValueError:
-                continue
-
-        self.db.execute(f'PRAGMA user_version = {NEXT_VERSION}')
-        self.db.commit()
-
-        logger.info("Updated {} of {} rows".format(updated_rows, len(all_rows)))
-        return NEXT_VERSION
-
-    def _migrate_01_02_create_breaks_table(self):
-        logger.info("Starting 01->02 migration...")
-        NEXT_VERSION = 2
-
-        self.db.executescript(
-            '''
-            CREATE TABLE IF NOT EXISTS breaks (
-                id  INTEGER PRIMARY KEY,
-                day TEXT NOT NULL,
-                start TEXT NOT NULL,
-                end TEXT NULL
-            );
-            ''')
-
-        self.db.execute(f'PRAGMA user_version = {NEXT_VERSION}')
-        self.db.commit()
-
-        logger.info("Finished migration. Created breaks table")
-        return NEXT_VERSION
-
-    def _migrate_02_03_create_notes_table(self):
-        logger.info("Starting 02->03 migration...")
-        NEXT_VERSION = 3
-
-        self.db.executescript(
-            '''
-            CREATE TABLE IF NOT EXISTS notes (
-                id  INTEGER PRIMARY KEY,
-                day TEXT NOT NULL,
-                note TEXT NOT NULL
-            );
-            ''')
-
-        self.db.execute(f'PRAGMA user_version = {NEXT_VERSION}')
-        self.db.commit()
-
-        logger.info("Finished migration. Created notes table")
-        return NEXT_VERSION
-
-
-    def update_in_out(self):
-        cur = self.db.execute("SELECT day, intime, outtime, total FROM workdays WHERE day=date('now')")
-        current = cur.fetchone()
-        if current is not None:
-            current = dict(current)
-
-        if current:
+    @staticmethod
+    def _current_day(now=None):
+        """ same day as date('now') in SQLite """
+        return time.strftime('%Y-%m-%d', time.gmtime(now))
+
+    def _sync(self, now=None):
+        """ Drop the cached state of today if it may be out of date """
+        day = self._current_day(now)
+        data_version = self.db.execute('PRAGMA data_version').fetchone()[0]
+        if day != self._cached_day or data_version != self._data_version:
+            self.flush()
+            self._today = None
+            self._open_break = _UNKNOWN
+            self._cached_day = day
+            self._data_version = data_version
+
+    def _punch(self, now=None):
+        """ Buffer a punch at now in today's row """
+        now = time.strftime('%H:%M:%S', time.localtime(now))
+
+        if self._today is None:
+            cur = self.db.execute("SELECT day, intime, outtime, total FROM workdays WHERE day=?",
+                                  (self._cached_day,))
+            current = cur.fetchone()
+            self._today = dict(current) if current is not None else None
+
+        if self._today:
             # Update 'out'
-            out = time.strftime('%H:%M:%S')
-            total = self.calc_tot_time(current['intime'], out)
-
-            cur = self.db.execute("UPDATE workdays SET outtime=?, total=? WHERE day=date('now')", (
-                out,
-                total,
-                ))
-            self.db.commit()
+            self._today.update(outtime=now, total=self.calc_tot_time(self._today['intime'], now))
         else:
             # Create 'intime', new day
-            cur = self.db.execute("INSERT INTO workdays VALUES (date('now'),?,?,?)", (
-                time.strftime('%H:%M:%S'),
-                time.strftime('%H:%M:%S'),
-                '08:00:00'
-                ))
-            self.db.commit()
-
-    def in_signal(self):
-        self._handle_return_from_break()
-        self.update_in_out()
-
-    def out_signal(self):
-        self.update_in_out()
+            self._today = dict(day=self._cached_day, intime=now, outtime=now, total='08:00:00')
+        self._dirty = True
+
+    def update_in_out(self, now=None):
+        with self._lock:
+            self._sync(now)
+            self._punch(now)
+
+        self._written()
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                # total is recomputed from the stored intime in case another
+                # process created today's row after it was read
+                self.db.execute(
+                    """
+                    INSERT INTO workdays (day, intime, outtime, total) VALUES (:day, :intime, :outtime, :total)
+                    ON CONFLICT (day) DO UPDATE SET
+                        outtime = excluded.outtime,
+                        total = time(strftime('%s', excluded.outtime) - strftime('%s', workdays.intime), 'unixepoch')
+                    """, self._today)
+                self._dirty = False
+            if self.db.in_transaction:
+                self.db.commit()
+                metrics.COMMITS.inc()
+
+    def in_signal(self, now=None):
+        with self._lock:
+            self._sync(now)
+            ended_break = self._handle_return_from_break(now)
+            self._punch(now)
+            if ended_break:
+                # breaks aren't buffered, commit the break with the punch
+                self.flush()
+
+        self._written()
+
+    def out_signal(self, now=None):
+        self.update_in_out(now)
 
     def get_today(self, day=None):
-        cur = self.db.execute("""
-                              SELECT w.*, COUNT(b.id) AS num_breaks,
-                                SUM(strftime('%s', b.end)-strftime('%s', b.start)) AS break_secs
-                              FROM workdays w
-                              LEFT OUTER JOIN breaks b on w.day=b.day
-                              WHERE w.day = date('now')
-                              """
-                              )
+        self.flush()
+        cur = self.db.execute("SELECT * FROM day_summary WHERE day = date('now')")
         current = cur.fetchone()
 
-        return PunchTime(**dict(current))
+        return PunchTime.from_row(current) if current is not None else None
 
-    def get_month(self, month=None):
+    @staticmethod
+    def _month_range(month=None):
+        """ first and last date of month, given as YYYY-MM[-DD] """
         if not month:
-            month = time.strftime('%Y-%m' + '-%')
-        else:
-            month = re.sub(r'(\d{4})-(\d{2}).*', r'\1-\2-%', month)
+            month = time.strftime('%Y-%m')
+        year, mon = map(int, month.split('-')[:2])
+        last_day_of_month = monthrange(year, mon)[1]
 
-        cur = self.db.execute(
-            """
-            SELECT w.*, COUNT(b.id) AS num_breaks,
-                SUM(DISTINCT strftime('%s', b.end)-strftime('%s', b.start)) AS break_secs,
-                (SELECT GROUP_CONCAT(n.note, ", ") FROM notes n WHERE n.day=w.day) AS notes
-            FROM workdays w
-                 LEFT OUTER JOIN breaks b on w.day=b.day
-            LEFT OUTER JOIN notes n on w.day=n.day
-            WHERE w.day LIKE ?
-            GROUP BY w.day
-            ORDER BY w.day
-            """, (month,))
-
-        return cur.fetchall()
+        return f'{year:04d}-{mon:02d}-01', f'{year:04d}-{mon:02d}-{last_day_of_month:02d}'
+
+    def get_month(self, month=None):
+        return list(self.get_range(*self._month_range(month)))
+
+    def get_range(self, start_date, end_date, batch_size=500):
+        """ workdays between start_date and end_date in one query, yielded in day order """
+        self.flush()
+
+        cur = self.db.execute("SELECT * FROM day_summary WHERE day BETWEEN ? AND ? ORDER BY day",
+                              (start_date, end_date))
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
 
     def get_total_report(self, start_date=None, end_date=None):
         if not start_date:
@@ -176,49 +153,143 @@ class SqLiteOutput(BundyLedger):
         if not end_date:
             end_date = time.strftime('%Y-%m-%d')
 
+        # Whole months are read from month_summary, the days before and
+        # after them from day_summary
+        start = datetime.date.fromisoformat(start_date)
+        end = datetime.date.fromisoformat(end_date)
+        one_day = datetime.timedelta(days=1)
+        first = start if start.day == 1 else (start.replace(day=28) + 4 * one_day).replace(day=1)
+        last = end if end.day == monthrange(end.year, end.month)[1] else end.replace(day=1) - one_day
+
+        selects, params = [], []
+        if first < last:
+            selects.append("SELECT total_secs, break_secs FROM month_summary WHERE month BETWEEN ? AND ?")
+            params += [first.strftime('%Y-%m'), last.strftime('%Y-%m')]
+            day_ranges = [(start, first - one_day), (last + one_day, end)]
+        else:
+            day_ranges = [(start, end)]
+
+        for range_start, range_end in day_ranges:
+            if range_start <= range_end or not selects:
+                selects.append("SELECT total_secs, break_secs FROM day_summary WHERE day BETWEEN ? AND ?")
+                params += [range_start.isoformat(), range_end.isoformat()]
+
+        self.flush()
         cur = self.db.execute(
             """
-            SELECT SUM(DISTINCT(strftime('%s', total))-strftime('%s', '00:00:00')) AS total_day,
-                SUM(strftime('%s', b.end)-strftime('%s', b.start)) AS total_break
-            from workdays w
-            LEFT OUTER JOIN breaks b ON w.day=b.day
-            WHERE strftime('%s', w.day) BETWEEN strftime('%s', ?) AND strftime('%s', ?)
-            """, (start_date, end_date))
+            SELECT SUM(total_secs) AS total_day, SUM(break_secs) AS total_break
+            FROM ({})
+            """.format(' UNION ALL '.join(selects)), params)
 
         return cur.fetchone()
 
-    def take_a_break(self):
-        # start break by saving break record
-        self.db.execute("INSERT INTO breaks (day, start) VALUES (date('now'),?)", (
-                time.strftime('%H:%M:%S'),
-                ))
-        self.db.commit()
+    def take_a_break(self, now=None):
+        with self._lock:
+            self._sync(now)
+            # breaks that were never ended are replaced by the new one
+            if self._open_break is _UNKNOWN:
+                self._prune_stale_break_records()
+            elif self._open_break is not None:
+                self.db.execute("DELETE FROM breaks WHERE id=?", (self._open_break,))
+            # start break by saving break record
+            cur = self.db.execute("INSERT INTO breaks (day, start) VALUES (?,?)", (
+                    self._cached_day,
+                    time.strftime('%H:%M:%S', time.localtime(now)),
+                    ))
+            self.flush()
+            self._open_break = cur.lastrowid
         logger.debug("Saved start break time")
 
-    def _handle_return_from_break(self):
-        cur = self.db.execute("""
-                              SELECT * FROM breaks WHERE day = date('now') AND end is NULL ORDER BY start DESC;
-                              """
-                              )
-        latest_break_record = cur.fetchone()
-        if latest_break_record:
-            cur = self.db.execute("UPDATE breaks SET end=? WHERE id=?", (
-                time.strftime('%H:%M:%S'),
-                latest_break_record['id'],
-                ))
-            self.db.commit()
-            logger.info("End break")
+    def _handle_return_from_break(self, now=None):
+        """ End today's open break, True if there was one """
+        loaded = self._open_break is _UNKNOWN
+        if loaded:
+            cur = self.db.execute("""
+                                  SELECT id FROM breaks WHERE day = ? AND end is NULL ORDER BY start DESC LIMIT 1
+                                  """, (self._cached_day,)
+                                  )
+            latest_break_record = cur.fetchone()
+            self._open_break = latest_break_record['id'] if latest_break_record else None
+
+        if self._open_break is None:
+            return False
+
+        self.db.execute("UPDATE breaks SET end=? WHERE id=?", (
+            time.strftime('%H:%M:%S', time.localtime(now)),
+            self._open_break,
+            ))
+        self._open_break = None
+        logger.info("End break")
+        if loaded:
+            # breaks left open on earlier days, looked for once per cache load
             self._prune_stale_break_records()
+        return True
 
     def _prune_stale_break_records(self):
         cur = self.db.execute("DELETE FROM breaks WHERE end is NULL")
         if cur.rowcount:
             logger.info(f"Deleting {cur.rowcount} stale break records")
-            self.db.commit()
 
     def add_note(self, note, date):
         self.db.execute("INSERT INTO notes (day, note) VALUES (?,?)", (
             date,
             note,
             ))
+        self.flush()
+
+
+class SqLiteEventOutput(SqLiteOutput):
+    """
+    Append-only ledger mode. Every punch is a single insert into the events
+    table, workdays and breaks are maintained from the events by triggers.
+    """
+
+    def __init__(self, filename, durability=DURABILITY_EVENT, flush_interval=30):
+        self._events = []
+        super().__init__(filename, durability, flush_interval)
+
+    def _append_event(self, kind, now=None):
+        with self._lock:
+            self._events.append((self._current_day(now), time.strftime('%H:%M:%S', time.localtime(now)), kind))
+        self._written()
+
+    def flush(self):
+        with self._lock:
+            if self._events:
+                self.db.executemany("INSERT INTO events (day, time, kind) VALUES (?,?,?)", self._events)
+                self._events = []
+            super().flush()
+
+    def update_in_out(self, now=None):
+        self._append_event('out', now)
+
+    def in_signal(self, now=None):
+        self._append_event('in', now)
+
+    def out_signal(self, now=None):
+        self._append_event('out', now)
+
+    def take_a_break(self, now=None):
+        self._append_event('break', now)
+        logger.debug("Saved start break time")
+
+    def rebuild(self, start_date, end_date):
+        """
+        Re-derive workdays and breaks between start_date and end_date (inclusive)
+        by replaying the raw events through the rollup triggers. Days without
+        any events, e.g. history recorded before the event log existed, are kept.
+        """
+        period = (start_date, end_date)
+        self.flush()
+        self.db.execute("DELETE FROM workdays WHERE day IN "
+                        "(SELECT day FROM events WHERE day BETWEEN ? AND ?)", period)
+        self.db.execute("DELETE FROM breaks WHERE day IN "
+                        "(SELECT day FROM events WHERE day BETWEEN ? AND ?)", period)
+        self.db.execute("CREATE TEMP TABLE replay AS "
+                        "SELECT * FROM events WHERE day BETWEEN ? AND ?", period)
+        self.db.execute("DELETE FROM events WHERE day BETWEEN ? AND ?", period)
+        cur = self.db.execute("INSERT INTO events SELECT * FROM replay ORDER BY id")
+        self.db.execute("DROP TABLE replay")
         self.db.commit()
+
+        logger.info(f"Rebuilt workdays from {cur.rowcount} events")
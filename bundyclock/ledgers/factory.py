@@ -1,17 +1,44 @@
-from .ledgers import JsonOutput, TextOutput, BundyHttpRest
-from .dbledger import SqLiteOutput
+from .ledgers import DURABILITY_EVENT
+
 
 def get_ledger(**kwargs):
+    # Ledger modules are imported on demand, only the chosen ledger's dependencies are loaded
     output = kwargs.get('ledger_type')
 
-    if 'sqlite' in output:
+    durability = dict(durability=kwargs.get('durability', DURABILITY_EVENT),
+                      flush_interval=float(kwargs.get('flush_interval', 30)))
+
+    if ',' in output:
+        # several ledgers, e.g. sqlite,http-rest, checked first as any of the names below may be part of it
+        from .composite import CompositeLedger
+        sinks = []
+        for ledger_type in output.split(','):
+            ledger_type = ledger_type.strip()
+            timeout = kwargs.get('http_timeout' if ledger_type == 'http-rest' else 'sink_timeout', 5)
+            sinks.append((get_ledger(**dict(kwargs, ledger_type=ledger_type)), float(timeout)))
+        return CompositeLedger(sinks)
+    elif 'sqlite-events' in output:
+        from .dbledger import SqLiteEventOutput
+        filename = '{}.db'.format(kwargs.get('ledger_file').split('.')[0])
+        return SqLiteEventOutput(filename, **durability)
+    elif 'sqlite' in output:
+        from .dbledger import SqLiteOutput
         filename = '{}.db'.format(kwargs.get('ledger_file').split('.')[0])
-        return SqLiteOutput(filename)
+        return SqLiteOutput(filename, **durability)
+    elif 'jsonl' in output:
+        from .ledgers import JsonLinesOutput
+        filename = '{}.jsonl'.format(kwargs.get('ledger_file').split('.')[0])
+        return JsonLinesOutput(filename)
     elif 'json' in output:
+        from .ledgers import JsonOutput
         filename = '{}.json'.format(kwargs.get('ledger_file').split('.')[0])
         return JsonOutput(filename)
     elif 'text' in output:
+        from .ledgers import TextOutput
         filename = '{}.txt'.format(kwargs.get('ledger_file').split('.')[0])
         return TextOutput(filename)
     elif 'http-rest' in output:
-        return BundyHttpRest(kwargs.get('url'))
\ No newline at end of file
+        from .httpledger import BundyHttpRest
+        return BundyHttpRest(kwargs.get('url'),
+                             outbox_file=kwargs.get('outbox_file', 'http_outbox.db'),
+                             timeout=float(kwargs.get('http_timeout', 5)))
@@ -0,0 +1,265 @@
+import requests
+import threading
+import time
+
+from calendar import monthrange
+from itertools import groupby
+
+from .ledgers import BundyLedger, PunchTime
+from .outbox import Outbox
+from .. import metrics
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BundyHttpRest(BundyLedger):
+    """
+    Punches are recorded in a local outbox and replayed to the REST API by a
+    background flusher, so lock/unlock handling never waits for the network.
+    """
+    can_report = True
+    remote = True
+    BATCH_SIZE = 100
+
+    def __init__(self, url, outbox_file='http_outbox.db', timeout=5.0, flush_interval=60):
+        self.url = url
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.outbox = Outbox(outbox_file)
+        metrics.OUTBOX_DEPTH.set_function(self.outbox.__len__)
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._flusher = None
+        # whether the server creates a list of workdays in one POST, None until tried
+        self._bulk_create = None
+
+    def update_in_out(self, now=None):
+        now = time.localtime(now)
+        self.outbox.put(time.strftime('%Y-%m-%d', now), time.strftime('%H:%M:%S', now))
+
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='bundyclock-outbox', daemon=True)
+            self._flusher.start()
+        self._wakeup.set()
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if not self._stopped.is_set():
+                try:
+                    self.flush()
+                except Exception:
+                    # keep the flusher alive, the punches stay queued for the next attempt
+                    logger.exception("Outbox flush failed, punches kept for the next attempt")
+                    metrics.HTTP_RETRIES.inc()
+
+    def flush(self):
+        """
+        Replay queued punches to the server in batches, one request pair per day.
+        Returns False if the server couldn't be reached or failed, the punches
+        are then kept in the outbox for the next attempt. A day the server
+        refuses is moved aside, so that it doesn't hold up the days after it.
+        """
+        with self._flush_lock:
+            while True:
+                batch = self.outbox.peek(self.BATCH_SIZE)
+                if not batch:
+                    return True
+
+                for day, punches in groupby(batch, key=lambda punch: punch['day']):
+                    punches = list(punches)
+                    try:
+                        self._send_day(day, punches[0]['time'], punches[-1]['time'])
+                    except requests.exceptions.RequestException as e:
+                        if not self._retryable(e):
+                            logger.error("Server refused {} punches of {}, moved aside in the outbox: {}"
+                                         .format(len(punches), day, e))
+                            metrics.HTTP_REJECTED.inc()
+                            self.outbox.reject(punches[-1]['id'], str(e))
+                            continue
+                        logger.warning("Delivery failed, {} punches queued: {}".format(len(self.outbox), e))
+                        metrics.HTTP_RETRIES.inc()
+                        return False
+                    self.outbox.ack(punches[-1]['id'])
+
+    @staticmethod
+    def _retryable(e):
+        """ whether a later attempt may succeed, the server unreachable, slow or failing """
+        if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        response = getattr(e, 'response', None)
+        return response is not None and response.status_code >= 500
+
+    @staticmethod
+    def _raise_for_status(r):
+        """ raise HTTPError for any reply but 2xx, raise_for_status lets redirects through """
+        if not 200 <= r.status_code < 300:
+            raise requests.exceptions.HTTPError('{} {} for url: {}'.format(r.status_code, r.reason, r.url),
+                                                response=r)
+
+    def _send_day(self, current_date, intime, outtime):
+        item_url = self.url + current_date + r'/'
+
+        with metrics.HTTP_SECONDS.time(method='GET'):
+            r = self.session.get(item_url, timeout=self.timeout)
+        if r.status_code == 404:
+            # Current date not found, lets create it
+            with metrics.HTTP_SECONDS.time(method='POST'):
+                r = self.session.post(self.url, data=dict(
+                    date=current_date,
+                    intime=intime,
+                    outtime=outtime,
+                ), timeout=self.timeout)
+            self._raise_for_status(r)
+
+        elif r.status_code == 200:
+            # Update current data
+            punch_time = r.json()
+            punch_time['outtime'] = outtime
+            with metrics.HTTP_SECONDS.time(method='PUT'):
+                r = self.session.put(item_url, data=punch_time, timeout=self.timeout)
+            self._raise_for_status(r)
+
+        else:
+            logger.error("Something went wrong: {}".format(r.status_code))
+            self._raise_for_status(r)
+
+    def in_signal(self, now=None):
+        self.update_in_out(now)
+
+    def out_signal(self, now=None):
+        self.update_in_out(now)
+
+    def close(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        self.session.close()
+
+    def get_today(self):
+        self.flush()
+
+        current_date = time.strftime('%Y-%m-%d')
+        item_url = self.url + current_date + r'/'
+        try:
+            r = self.session.get(item_url, timeout=self.timeout)
+            if r.status_code == requests.codes.ok:
+                punch_time = r.json()
+                # rename pk
+                self._rename_pk(punch_time)
+
+                return PunchTime.from_row(punch_time)
+            else:
+                self._raise_for_status(r)
+
+        except requests.exceptions.RequestException as e:
+            logger.exception("Connection proplem: {}".format(e))
+
+    def _rename_pk(self, punch_time):
+        punch_time['day'] = punch_time.pop('date')
+        return punch_time
+
+    def get_total_report(self, start_date=None, end_date=None):
+        if not start_date:
+            start_date = time.strftime('%Y-%m-01')
+        if not end_date:
+            end_date = time.strftime('%Y-%m-%d')
+
+        self.flush()
+
+        url = '{base_url}total_sum/?start_date={start_date}&end_date={end_date}'.format(
+            base_url=self.url,
+            start_date=start_date,
+            end_date=end_date
+        )
+        try:
+            r = self.session.get(url, timeout=self.timeout)
+            if r.status_code == requests.codes.ok:
+                total_sum = r.json()
+
+                return total_sum['total_sum']
+            else:
+                self._raise_for_status(r)
+
+        except requests.exceptions.RequestException as e:
+            logger.exception("Connection proplem: {}".format(e))
+
+    def get_month(self, year_month=None):
+        if not year_month:
+            year_month = time.strftime('%Y-%m')
+
+        start_date = year_month + '-01'
+        last_day_of_month = monthrange(*map(int, year_month.split('-')[:2]))[1]
+        end_date = '{}-{}'.format(year_month, last_day_of_month)
+
+        return self.get_range(start_date, end_date)
+
+    def _fetch_range(self, start_date, end_date):
+        url = self.url + '?start_date={}&end_date={}'.format(start_date, end_date)
+        with metrics.HTTP_SECONDS.time(method='GET'):
+            r = self.session.get(url, timeout=self.timeout)
+        self._raise_for_status(r)
+
+        return sorted(map(self._rename_pk, r.json()), key=lambda workday: workday['day'])
+
+    def get_range(self, start_date, end_date):
+        """ workdays between start_date and end_date in one request, in day order """
+        self.flush()
+
+        try:
+            return self._fetch_range(start_date, end_date)
+        except requests.exceptions.RequestException as e:
+            logger.exception("Connection proplem: {}".format(e))
+
+    def send_workdays(self, workdays):
+        """
+        Store complete workdays (dicts with day, intime, outtime and total),
+        e.g. history imported from another ledger. Existing days are looked up
+        with one request and updated, new days are created with a single POST
+        of the whole list if the server accepts lists, else one by one.
+        """
+        workdays = list(workdays)
+        if not workdays:
+            return
+
+        days = [workday['day'] for workday in workdays]
+        existing = {workday['day'] for workday in self._fetch_range(min(days), max(days))}
+
+        new = []
+        for workday in workdays:
+            data = dict(date=workday['day'], intime=workday['intime'], outtime=workday['outtime'],
+                        total=workday['total'])
+            if workday['day'] in existing:
+                with metrics.HTTP_SECONDS.time(method='PUT'):
+                    r = self.session.put(self.url + workday['day'] + r'/', data=data, timeout=self.timeout)
+                self._raise_for_status(r)
+            else:
+                new.append(data)
+
+        if new and self._bulk_create is not False:
+            with metrics.HTTP_SECONDS.time(method='POST'):
+                r = self.session.post(self.url, json=new, timeout=self.timeout)
+            if r.status_code in (400, 405, 415) and self._bulk_create is None:
+                logger.info("Server doesn't accept lists of workdays, creating them one by one")
+                self._bulk_create = False
+            else:
+                self._raise_for_status(r)
+                self._bulk_create = True
+                return
+
+        for data in new:
+            with metrics.HTTP_SECONDS.time(method='POST'):
+                r = self.session.post(self.url, data=data, timeout=self.timeout)
+            self._raise_for_status(r)
@@ -3,60 +3,196 @@ Created on Apr 6, 2013
 
 Copyright (c) 2018 Dan Hallgren  <dan.hallgren@gmail.com>
 """
-import datetime
+import io
 import json
 import os
 import re
-import requests
+import threading
 import time
 
 from abc import ABCMeta, abstractmethod
-from calendar import monthrange
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Durability policies, when buffered ledger writes reach storage
+DURABILITY_EVENT = 'event'
+DURABILITY_INTERVAL = 'interval'
+DURABILITY_EXIT = 'exit'
+DURABILITY_POLICIES = (DURABILITY_EVENT, DURABILITY_INTERVAL, DURABILITY_EXIT)
+
+
+SECONDS_PER_DAY = 24 * 3600
+
+
+def hms_to_seconds(time_hms):
+    """ seconds of a time or duration in HH:MM:SS format """
+    h, m, s = time_hms.split(':')
+    return int(h) * 3600 + int(m) * 60 + int(s)
+
+
+def seconds_to_hms(seconds):
+    """ HH:MM:SS format of seconds """
+    h, s = divmod(seconds, 3600)
+    m, s = divmod(s, 60)
+    return "%02d:%02d:%02d" % (h, m, s)
+
+
+def _as_seconds(value):
+    """ seconds of an HH:MM:SS string, integers are taken as seconds already """
+    if value is None or isinstance(value, int):
+        return value
+    return hms_to_seconds(value)
+
+
+def reverse_lines(fd, block_size=io.DEFAULT_BUFFER_SIZE):
+    """
+    Yield (offset, line) for every line of the binary file object fd, last
+    line first. The file is read backwards one block at a time, so finding
+    the last records does not depend on the file size or on line lengths.
+    """
+    fd.seek(0, os.SEEK_END)
+    pos = fd.tell()
+    buf = b''
+    end = 0
+    while True:
+        # skip the newline terminating the current line when searching
+        nl = buf.rfind(b'\n', 0, end - 1) if end else -1
+        if nl >= 0:
+            yield pos + nl + 1, buf[nl + 1:end]
+            end = nl + 1
+        elif pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            fd.seek(pos)
+            buf = fd.read(step) + buf[:end]
+            end = len(buf)
+        else:
+            if end:
+                yield 0, buf[:end]
+            return
+
 
 class BundyLedger:
     __metaclass__ = ABCMeta
     can_report = False
+    # stored elsewhere, slower to read than a local ledger
+    remote = False
+    durability = DURABILITY_EVENT
+    flush_interval = 30
+    _flush_timer = None
+
+    # Punches are at now, seconds since the epoch, or at the current time
 
     @abstractmethod
-    def in_signal(self):
+    def in_signal(self, now=None):
         pass
 
     @abstractmethod
-    def out_signal(self):
+    def out_signal(self, now=None):
         pass
 
     @abstractmethod
     def get_today(self):
         pass
 
-    def take_a_break(self):
+    def take_a_break(self, now=None):
         logger.error("Bundy says no! Go back to work")
 
-    @staticmethod
-    def calc_tot_time(t_in, t_out):
-        delta_t = (datetime.datetime(*time.strptime(t_out, '%H:%M:%S')[:7]) -
-                   datetime.datetime(*time.strptime(t_in, '%H:%M:%S')[:7]))
+    def set_durability(self, durability, flush_interval=30):
+        if durability not in DURABILITY_POLICIES:
+            raise ValueError("durability must be one of {}, not '{}'".format(
+                ', '.join(DURABILITY_POLICIES), durability))
+        self.durability = durability
+        self.flush_interval = flush_interval
+
+    def _written(self):
+        """
+        To be called after a write was buffered. Depending on the durability
+        policy it is flushed right away, within flush_interval seconds or on close.
+        """
+        if self.durability == DURABILITY_EVENT:
+            self.flush()
+        elif self.durability == DURABILITY_INTERVAL and self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_interval, self._timed_flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _timed_flush(self):
+        self._flush_timer = None
+        self.flush()
+
+    def flush(self):
+        """ Write buffered changes to storage """
+        pass
 
-        h, s = divmod(delta_t.seconds, 3600)
-        m, s = divmod(s, 60)
+    def close(self):
+        """ Release resources, pending writes are flushed before returning """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        self.flush()
 
-        total_time = "%02d:%02d:%02d" % (h, m, s)
-        return total_time
+    @staticmethod
+    def calc_tot_time(t_in, t_out):
+        # wraps around midnight
+        return seconds_to_hms((hms_to_seconds(t_out) - hms_to_seconds(t_in)) % SECONDS_PER_DAY)
 
 
 class PunchTime(object):
-    def __init__(self, day, intime, outtime, total, num_breaks=0, break_secs=0):
+    """
+    A workday, times are kept as seconds and formatted as HH:MM:SS on access.
+    intime, outtime and total may be given in either form.
+    """
+    __slots__ = ('day', 'in_secs', 'out_secs', 'total_secs', 'num_breaks', 'break_secs', 'notes')
+
+    def __init__(self, day, intime, outtime, total, num_breaks=0, break_secs=0, notes=None):
         self.day = day
-        self.intime = intime
-        self.outtime = outtime
-        self.total = total
+        self.in_secs = _as_seconds(intime)
+        self.out_secs = _as_seconds(outtime)
+        self.total_secs = _as_seconds(total)
         self.num_breaks = num_breaks
         self.break_secs = break_secs
+        self.notes = notes
+
+    @classmethod
+    def from_row(cls, row):
+        """ PunchTime of a ledger row or API record, stored seconds are used when present """
+        row = dict(row)
+        total = row.get('total_secs')
+        return cls(row['day'] if 'day' in row else row['date'],
+                   row['intime'],
+                   row['outtime'],
+                   row['total'] if total is None else total,
+                   row.get('num_breaks') or 0,
+                   row.get('break_secs') or 0,
+                   row.get('notes'))
+
+    @property
+    def intime(self):
+        try:
+            return seconds_to_hms(self.in_secs)
+        except TypeError:
+            return seconds_to_hms(0)
+
+    @property
+    def outtime(self):
+        try:
+            return seconds_to_hms(self.out_secs)
+        except TypeError:
+            return seconds_to_hms(0)
+
+    @property
+    def total(self):
+        try:
+            return seconds_to_hms(self.total_secs)
+        except TypeError:
+            return seconds_to_hms(0)
+
+    @property
+    def worked_secs(self):
+        return (self.total_secs or 0) - (self.break_secs or 0)
 
     def __str__(self):
         return f"{self.day} - In: {self.intime} Out: {self.outtime} Total: {self.total}. "\
@@ -65,45 +201,55 @@ class PunchTime(object):
     @property
     def break_time(self) -> str:
         try:
-            h, s = divmod(self.break_secs, 3600)
-            m, s = divmod(s, 60)
+            return seconds_to_hms(self.break_secs)
         except TypeError:
-            (h, m, s) = (0, 0, 0)
-        return "%02d:%02d:%02d" % (h, m, s)
+            return seconds_to_hms(0)
 
 
 class TextOutput(BundyLedger):
+    RECORD = re.compile(r'(?P<day>.*) - In: (?P<in>.*) Out: (?P<out>.*) Total: (?P<total>.*)\s*$')
+
     def __init__(self, file_name):
         self.file = file_name
 
-    def in_signal(self):
+    def in_signal(self, now=None):
         current = self.get_last_day()
-        today = time.strftime('%Y.%m.%d')
+        now = time.localtime(now)
+        today = time.strftime('%Y.%m.%d', now)
 
         if current is None or current['day'] != today:
             with open(self.file, 'ab') as fd:
-                if current is not None:
-                    fd.seek(-1, os.SEEK_END)  # Skip last newline
                 fd.write('{} - In: {} Out: {} Total: {}\n'.format(
                     today,
-                    time.strftime('%H:%M:%S'),
-                    time.strftime('%H:%M:%S'),
+                    time.strftime('%H:%M:%S', now),
+                    time.strftime('%H:%M:%S', now),
                     '00:00:00'
                 ).encode())
 
-    def out_signal(self):
-        out_time = time.strftime('%H:%M:%S')
+    def out_signal(self, now=None):
+        out_time = time.strftime('%H:%M:%S', time.localtime(now))
         current = self.get_last_day()
         total = self.calc_tot_time(current['in'], out_time)
         self.update_last_day(current['day'], current['in'], out_time, total)
 
+    def _reverse_records(self, fd):
+        """ (offset, record) for every record in fd, last record first """
+        for offset, line in reverse_lines(fd):
+            r = self.RECORD.match(line.decode())
+            if r:
+                yield offset, r.groupdict()
+
+    def _last_record(self, fd):
+        for offset, record in self._reverse_records(fd):
+            return offset, record
+
+        return None, None
+
     def get_last_day(self):
         try:
             with open(self.file, 'rb') as fd:
-                fd.seek(-56, os.SEEK_END)
-                lastline = fd.readline()
-            r = re.match(r'(?P<day>.*) - In: (?P<in>.*) Out: (?P<out>.*) Total: (?P<total>.*)\s*$', lastline.decode())
-            return r.groupdict()
+                _, record = self._last_record(fd)
+            return record
         except IOError:
             pass
 
@@ -112,19 +258,19 @@ class TextOutput(BundyLedger):
     def get_today(self):
         today = time.strftime('%Y.%m.%d')
         with open(self.file, 'rb') as fd:
-            for line in reversed(fd.readlines()):
-                r = re.match(
-                    r'(?P<day>{today}) - In: (?P<in>.*) Out: (?P<out>.*) Total: (?P<total>.*)\s*$'
-                    .format(today=today), line.decode())
-                if r:
-                    return PunchTime(r.groupdict()['day'],
-                                     r.groupdict()['in'],
-                                     r.groupdict()['out'],
-                                     r.groupdict()['total'])
+            for _, record in self._reverse_records(fd):
+                if record['day'] != today:
+                    # records are chronological, today can't be further back
+                    break
+                return PunchTime(record['day'],
+                                 record['in'],
+                                 record['out'],
+                                 record['total'])
 
     def update_last_day(self, day, t_in, t_out, total):
         with open(self.file, 'r+b') as fd:
-            fd.seek(-56, os.SEEK_END)
+            offset, _ = self._last_record(fd)
+            fd.seek(offset or 0)
             fd.write('{} - In: {} Out: {} Total: {}\n'.format(
                 day,
                 t_in,
@@ -141,24 +287,25 @@ class JsonOutput(BundyLedger):
     def __init__(self, filename):
         self.file = filename
 
-    def update_in_out(self):
+    def update_in_out(self, now=None):
         try:
             with open(self.file, 'r') as s:
                 my_times = json.load(s)
         except IOError:
             my_times = {}
 
-        key = time.strftime('%Y.%m.%d - %a')
+        now = time.localtime(now)
+        key = time.strftime('%Y.%m.%d - %a', now)
 
         today = my_times.get(key, {'out': '17:00:00', 'total': '08:00:00'})
 
         # Update 'in'
         if 'in' not in today:
             # in key should only be updated once a day
-            today.update({'in': time.strftime('%H:%M:%S')})
+            today.update({'in': time.strftime('%H:%M:%S', now)})
 
         # Update 'out'
-        today.update({'out': time.strftime('%H:%M:%S')})
+        today.update({'out': time.strftime('%H:%M:%S', now)})
 
         # Update 'total'
         total = self.calc_tot_time(today['in'], today['out'])
@@ -170,11 +317,11 @@ class JsonOutput(BundyLedger):
         with open(self.file, 'w') as s:
             json.dump(my_times, s, indent=2, sort_keys=True)
 
-    def in_signal(self):
-        self.update_in_out()
+    def in_signal(self, now=None):
+        self.update_in_out(now)
 
-    def out_signal(self):
-        self.update_in_out()
+    def out_signal(self, now=None):
+        self.update_in_out(now)
 
     def get_today(self):
         key = time.strftime('%Y.%m.%d - %a')
@@ -186,112 +333,90 @@ class JsonOutput(BundyLedger):
                              my_times.get(key)['out'],
                              my_times.get(key)['total'])
 
-class BundyHttpRest(BundyLedger):
-    """
 
+class JsonLinesOutput(BundyLedger):
     """
-    can_report = True
-
-    def __init__(self, url):
-        self.url = url
+    Append-only JSON Lines ledger. Every punch appends the current day's
+    record, superseded records of a day are compacted into one when the
+    next day starts.
+    """
+    def __init__(self, filename):
+        self.file = filename
 
-    def update_in_out(self):
-        current_date = time.strftime('%Y-%m-%d')
-        item_url = self.url + current_date + r'/'
+    def _reverse_records(self, fd):
+        for offset, line in reverse_lines(fd):
+            try:
+                yield offset, json.loads(line)
+            except ValueError:
+                # e.g. left over from an interrupted compaction
+                continue
 
+    def _get_last_record(self):
         try:
-            r = requests.get(item_url)
-            if r.status_code == 404:
-                # Current date not found, lets create it
-                r = requests.post(self.url, data=dict(
-                    date=current_date,
-                    intime=time.strftime('%H:%M:S'),
-                    outtime=time.strftime('%H:%M:S'),
-                ))
-                r.raise_for_status()
-
-            elif r.status_code == 200:
-                # Update current data
-                punch_time = r.json()
-                punch_time['outtime'] = time.strftime('%H:%M:S')
-                r = requests.put(item_url, data=punch_time)
-                r.raise_for_status()
-
-            else:
-                logger.error("Something went wrong: {}".format(r.status_code))
-                r.raise_for_status()
-
-        except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as e:
-            logger.exception("Connection proplem: {}".format(e))
-
-    def in_signal(self):
-        self.update_in_out()
-
-    def out_signal(self):
-        self.update_in_out()
+            with open(self.file, 'rb') as fd:
+                for _, record in self._reverse_records(fd):
+                    return record
+        except IOError:
+            pass
 
-    def get_today(self):
-        current_date = time.strftime('%Y-%m-%d')
-        item_url = self.url + current_date + r'/'
-        try:
-            r = requests.get(item_url)
-            if r.status_code == requests.codes.ok:
-                punch_time = r.json()
-                # rename pk
-                self._rename_pk(punch_time)
-
-                return PunchTime(**punch_time)
-            else:
-                r.raise_for_status()
-
-        except requests.exceptions.ConnectionError as e:
-            logger.exception("Connection proplem: {}".format(e))
-
-    def _rename_pk(self, punch_time):
-        punch_time['day'] = punch_time.pop('date')
-        return punch_time
-
-    def get_total_report(self, start_date=None, end_date=None):
-        if not start_date:
-            start_date = time.strftime('%Y-%m-01')
-        if not end_date:
-            end_date = time.strftime('%Y-%m-%d')
-
-        url = '{base_url}total_sum/?start_date={start_date}&end_date={end_date}'.format(
-            base_url=self.url,
-            start_date=start_date,
-            end_date=end_date
-        )
-        try:
-            r = requests.get(url)
-            if r.status_code == requests.codes.ok:
-                total_sum = r.json()
+        return None
 
-                return total_sum['total_sum']
-            else:
-                r.raise_for_status()
+    def compact(self):
+        """ Collapse the trailing run of records for the last day into one """
+        try:
+            fd = open(self.file, 'r+b')
+        except IOError:
+            return
+
+        with fd:
+            last_line = None
+            first_offset = None
+            for offset, line in reverse_lines(fd):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    first_offset = offset
+                    continue
+                if last_line is None:
+                    last_line, day = line, record['day']
+                elif record['day'] != day:
+                    break
+                first_offset = offset
+
+            if last_line is None or first_offset is None:
+                return
+
+            fd.seek(first_offset)
+            fd.write(last_line.rstrip(b'\n') + b'\n')
+            fd.truncate()
+
+    def update_in_out(self, now=None):
+        now = time.localtime(now)
+        key = time.strftime('%Y.%m.%d - %a', now)
+        now = time.strftime('%H:%M:%S', now)
+
+        today = self._get_last_record()
+        if today is None or today['day'] != key:
+            if today is not None:
+                self.compact()
+            # in key should only be updated once a day
+            today = {'day': key, 'in': now}
 
-        except requests.exceptions.ConnectionError as e:
-            logger.exception("Connection proplem: {}".format(e))
+        today.update({'out': now})
+        today.update({'total': self.calc_tot_time(today['in'], today['out'])})
 
-    def get_month(self, year_month=None):
-        if not year_month:
-            year_month = time.strftime('%Y-%m')
+        with open(self.file, 'a') as s:
+            s.write(json.dumps(today, sort_keys=True) + '\n')
 
-        start_date = year_month + '-01'
-        last_day_of_month = monthrange(*map(int, year_month.split('-')[:2]))[1]
-        end_date = '{}-{}'.format(year_month, last_day_of_month)
+    def in_signal(self, now=None):
+        self.update_in_out(now)
 
-        url = self.url + '?start_date={}&end_date={}'.format(start_date, end_date)
-        try:
-            r = requests.get(url)
-            if r.status_code == requests.codes.ok:
-                workdays = r.json()
-                workdays = map(self._rename_pk, workdays)
+    def out_signal(self, now=None):
+        self.update_in_out(now)
 
-                return workdays
-            else:
-                r.raise_for_status()
+    def get_today(self):
+        key = time.strftime('%Y.%m.%d - %a')
 
-        except requests.exceptions.ConnectionError as e:
-            logger.exception("Connection proplem: {}".format(e))
+        today = self._get_last_record()
+        if today is not None and today['day'] == key:
+            return PunchTime(key, today['in'], today['out'], today['total'])
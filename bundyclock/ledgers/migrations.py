@@ -0,0 +1,355 @@
+"""
+Schema migrations of the sqlite ledger.
+
+Every migration is a SQL script registered under the user_version it brings
+the database to. Pending migrations are applied in version order, each in
+its own transaction together with its user_version bump, so a failing step
+leaves the database at the previous version.
+"""
+import sqlite3
+import time
+
+from collections import namedtuple
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+Migration = namedtuple('Migration', 'version description script sqlite_version')
+
+MIGRATIONS = {}
+
+
+def migration(version, description, sqlite_version=(3, 0, 0)):
+    """
+    register the SQL script returned by the decorated function as migration
+    to version, needing at least sqlite_version of the SQLite library
+    """
+    def register(function):
+        if version in MIGRATIONS:
+            raise ValueError('Duplicate migration to version {}'.format(version))
+        MIGRATIONS[version] = Migration(version, description, function(), sqlite_version)
+        return function
+    return register
+
+
+def _seconds(column):
+    """ SQL expression for the seconds of an HH:MM:SS column """
+    return (f"(CAST(substr({column}, 1, 2) AS INTEGER) * 3600 + CAST(substr({column}, 4, 2) AS INTEGER) * 60"
+            f" + CAST(substr({column}, 7, 2) AS INTEGER))")
+
+
+# Summary rows are derived from workdays, breaks and notes by these,
+# {where} selects the workdays/days to (re)compute. Up to version 6 the
+# seconds were parsed from the HH:MM:SS columns, later versions store them.
+_DAY_SUMMARY_SELECT_V6 = '''
+    INSERT INTO day_summary
+    SELECT day, intime, outtime, total, total_secs, break_secs,
+        total_secs - break_secs AS worked_secs, num_breaks, notes
+    FROM (
+        SELECT w.day, w.intime, w.outtime, w.total,
+            strftime('%s', w.total) - strftime('%s', '00:00:00') AS total_secs,
+            (SELECT COALESCE(SUM(strftime('%s', b.end) - strftime('%s', b.start)), 0)
+             FROM breaks b WHERE b.day = w.day) AS break_secs,
+            (SELECT COUNT(*) FROM breaks b WHERE b.day = w.day) AS num_breaks,
+            (SELECT GROUP_CONCAT(n.note, ', ') FROM notes n WHERE n.day = w.day) AS notes
+        FROM workdays w
+        WHERE {where}
+    )'''
+DAY_SUMMARY_SELECT = '''
+    INSERT INTO day_summary
+    SELECT day, intime, outtime, total, total_secs, break_secs,
+        total_secs - break_secs AS worked_secs, num_breaks, notes
+    FROM (
+        SELECT w.day, w.intime, w.outtime, w.total, w.total_secs,
+            (SELECT COALESCE(SUM(b.secs), 0) FROM breaks b WHERE b.day = w.day) AS break_secs,
+            (SELECT COUNT(*) FROM breaks b WHERE b.day = w.day) AS num_breaks,
+            (SELECT GROUP_CONCAT(n.note, ', ') FROM notes n WHERE n.day = w.day) AS notes
+        FROM workdays w
+        WHERE {where}
+    )'''
+MONTH_SUMMARY_SELECT = '''
+    INSERT INTO month_summary
+    SELECT substr(day, 1, 7), COUNT(*), SUM(total_secs), SUM(break_secs),
+        SUM(worked_secs), SUM(num_breaks)
+    FROM day_summary
+    WHERE {where}
+    GROUP BY substr(day, 1, 7)'''
+
+
+@migration(1, 'workdays table, YYYY-MM-DD dates')
+def _date_format():
+    # Early versions stored days as YYYY.MM.DD
+    return '''
+        CREATE TABLE IF NOT EXISTS workdays (
+            day TEXT UNIQUE,
+            intime TEXT,
+            outtime TEXT,
+            total TEXT
+        );
+        UPDATE workdays SET day = replace(day, '.', '-')
+            WHERE day GLOB '[0-9][0-9][0-9][0-9].[0-9][0-9].[0-9][0-9]';
+        '''
+
+
+@migration(2, 'breaks table')
+def _breaks_table():
+    return '''
+        CREATE TABLE IF NOT EXISTS breaks (
+            id  INTEGER PRIMARY KEY,
+            day TEXT NOT NULL,
+            start TEXT NOT NULL,
+            end TEXT NULL
+        );
+        '''
+
+
+@migration(3, 'notes table')
+def _notes_table():
+    return '''
+        CREATE TABLE IF NOT EXISTS notes (
+            id  INTEGER PRIMARY KEY,
+            day TEXT NOT NULL,
+            note TEXT NOT NULL
+        );
+        '''
+
+
+@migration(4, 'day indexes')
+def _day_indexes():
+    return '''
+        CREATE INDEX IF NOT EXISTS breaks_day_idx ON breaks (day, start);
+        CREATE INDEX IF NOT EXISTS notes_day_idx ON notes (day);
+        '''
+
+
+def _events_triggers():
+    # the workdays and breaks tables are kept as rollups of the events
+    return '''
+        CREATE TRIGGER IF NOT EXISTS events_in AFTER INSERT ON events
+        WHEN NEW.kind = 'in'
+        BEGIN
+            UPDATE breaks SET end = NEW.time
+                WHERE id = (SELECT id FROM breaks
+                            WHERE day = NEW.day AND end IS NULL
+                            ORDER BY start DESC LIMIT 1);
+            DELETE FROM breaks WHERE day = NEW.day AND end IS NULL;
+            INSERT OR IGNORE INTO workdays (day, intime, outtime, total)
+                VALUES (NEW.day, NEW.time, NEW.time, '00:00:00');
+            UPDATE workdays
+                SET outtime = NEW.time,
+                    total = time(strftime('%s', NEW.time) - strftime('%s', intime), 'unixepoch')
+                WHERE day = NEW.day;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS events_out AFTER INSERT ON events
+        WHEN NEW.kind = 'out'
+        BEGIN
+            INSERT OR IGNORE INTO workdays (day, intime, outtime, total)
+                VALUES (NEW.day, NEW.time, NEW.time, '00:00:00');
+            UPDATE workdays
+                SET outtime = NEW.time,
+                    total = time(strftime('%s', NEW.time) - strftime('%s', intime), 'unixepoch')
+                WHERE day = NEW.day;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS events_break AFTER INSERT ON events
+        WHEN NEW.kind = 'break'
+        BEGIN
+            INSERT INTO breaks (day, start) VALUES (NEW.day, NEW.time);
+        END;
+        '''
+
+
+@migration(5, 'events table')
+def _events_table():
+    # Raw punch events
+    return '''
+        CREATE TABLE IF NOT EXISTS events (
+            id  INTEGER PRIMARY KEY,
+            day TEXT NOT NULL,
+            time TEXT NOT NULL,
+            kind TEXT NOT NULL CHECK (kind IN ('in', 'out', 'break'))
+        );
+        CREATE INDEX IF NOT EXISTS events_day_idx ON events (day);
+        ''' + _events_triggers()
+
+
+def _summary_triggers(day_summary_select):
+    # Keep the summaries current, day_summary rows are rebuilt from scratch
+    # whenever anything on their day changes, which in turn rebuilds the month.
+    script = ''
+    for table in ('workdays', 'breaks', 'notes'):
+        for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            script += f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_summary AFTER {event} ON {table}
+                BEGIN
+                    DELETE FROM day_summary WHERE day = {row}.day;
+                    {day_summary_select.format(where=f'w.day = {row}.day')};
+                END;
+                '''
+    for event, row in (('INSERT', 'NEW'), ('DELETE', 'OLD')):
+        month = f"substr({row}.day, 1, 7)"
+        script += f'''
+            CREATE TRIGGER IF NOT EXISTS day_summary_{event.lower()}_month AFTER {event} ON day_summary
+            BEGIN
+                DELETE FROM month_summary WHERE month = {month};
+                {MONTH_SUMMARY_SELECT.format(where=f"day BETWEEN {month} || '-01' AND {month} || '-31'")};
+            END;
+            '''
+    return script
+
+
+@migration(6, 'day and month summary tables')
+def _summary_tables():
+    script = f'''
+        CREATE TABLE IF NOT EXISTS day_summary (
+            day TEXT PRIMARY KEY,
+            intime TEXT,
+            outtime TEXT,
+            total TEXT,
+            total_secs INTEGER NOT NULL,
+            break_secs INTEGER NOT NULL,
+            worked_secs INTEGER NOT NULL,
+            num_breaks INTEGER NOT NULL,
+            notes TEXT
+        );
+        CREATE TABLE IF NOT EXISTS month_summary (
+            month TEXT PRIMARY KEY,
+            num_days INTEGER NOT NULL,
+            total_secs INTEGER NOT NULL,
+            break_secs INTEGER NOT NULL,
+            worked_secs INTEGER NOT NULL,
+            num_breaks INTEGER NOT NULL
+        );
+        {_DAY_SUMMARY_SELECT_V6.format(where='1')};
+        {MONTH_SUMMARY_SELECT.format(where='1')};
+        '''
+
+    return script + _summary_triggers(_DAY_SUMMARY_SELECT_V6)
+
+
+@migration(7, 'integer second columns', sqlite_version=(3, 31, 0))
+def _second_columns():
+    # workdays and breaks are rebuilt with stored generated columns, the
+    # triggers referring to them are dropped first and created anew after
+    drop_triggers = ''.join(f'DROP TRIGGER IF EXISTS {table}_{event}_summary;\n'
+                            for table in ('workdays', 'breaks', 'notes')
+                            for event in ('insert', 'update', 'delete'))
+    return f'''
+        DROP TRIGGER IF EXISTS events_in;
+        DROP TRIGGER IF EXISTS events_out;
+        DROP TRIGGER IF EXISTS events_break;
+        {drop_triggers}
+        CREATE TABLE workdays_v7 (
+            day TEXT UNIQUE,
+            intime TEXT,
+            outtime TEXT,
+            total TEXT,
+            intime_secs INTEGER GENERATED ALWAYS AS ({_seconds('intime')}) STORED,
+            outtime_secs INTEGER GENERATED ALWAYS AS ({_seconds('outtime')}) STORED,
+            total_secs INTEGER GENERATED ALWAYS AS ({_seconds('total')}) STORED
+        );
+        INSERT INTO workdays_v7 (day, intime, outtime, total) SELECT day, intime, outtime, total FROM workdays;
+        DROP TABLE workdays;
+        ALTER TABLE workdays_v7 RENAME TO workdays;
+
+        CREATE TABLE breaks_v7 (
+            id  INTEGER PRIMARY KEY,
+            day TEXT NOT NULL,
+            start TEXT NOT NULL,
+            end TEXT NULL,
+            secs INTEGER GENERATED ALWAYS AS ({_seconds('"end"')} - {_seconds('start')}) STORED
+        );
+        INSERT INTO breaks_v7 (id, day, start, end) SELECT id, day, start, end FROM breaks;
+        DROP TABLE breaks;
+        ALTER TABLE breaks_v7 RENAME TO breaks;
+        CREATE INDEX IF NOT EXISTS breaks_day_idx ON breaks (day, start);
+        ''' + _events_triggers() + _summary_triggers(DAY_SUMMARY_SELECT)
+
+
+def _statements(script):
+    """ split script into complete statements, trigger bodies included """
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ''
+    if statement.strip():
+        yield statement
+
+
+def current_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def pending(db):
+    """
+    migrations not yet applied to db, in the order they are applied. Stops
+    short of the first migration the SQLite library is too old for.
+    """
+    user_version = current_version(db)
+    migrations = []
+    for version in sorted(MIGRATIONS):
+        m = MIGRATIONS[version]
+        if version <= user_version:
+            continue
+        if sqlite3.sqlite_version_info < m.sqlite_version:
+            logger.warning("Schema kept at version {}, migration to version {} needs SQLite {} or newer".format(
+                migrations[-1].version if migrations else user_version, version,
+                '.'.join(map(str, m.sqlite_version))))
+            break
+        migrations.append(m)
+    return migrations
+
+
+def migrate(db, dry_run=False, progress=None):
+    """
+    Apply the pending migrations to db, returns them. progress is called
+    with (migration, step, steps, changed_rows, seconds) after every step.
+
+    With dry_run all steps run in a single transaction that is rolled back,
+    so the row counts are reported but the database is left untouched.
+    """
+    migrations = pending(db)
+    if not migrations:
+        return migrations
+
+    if db.in_transaction:
+        db.commit()
+
+    try:
+        for step, m in enumerate(migrations, start=1):
+            logger.info("Applying migration {}/{} to version {}, {}".format(step, len(migrations), m.version,
+                                                                          m.description))
+            if not db.in_transaction:
+                # IMMEDIATE, a concurrent connection may be migrating the same database
+                db.execute('BEGIN IMMEDIATE')
+                if current_version(db) >= m.version:
+                    db.commit()
+                    continue
+            start = time.perf_counter()
+            changes = db.total_changes
+            for statement in _statements(m.script):
+                db.execute(statement)
+            db.execute(f'PRAGMA user_version = {m.version:d}')
+            if not dry_run:
+                db.commit()
+            changes = db.total_changes - changes
+            seconds = time.perf_counter() - start
+
+            logger.info("Finished migration to version {}, {} rows changed in {:.2f} s".format(
+                m.version, changes, seconds))
+            if progress:
+                progress(m, step, len(migrations), changes, seconds)
+    finally:
+        if db.in_transaction:
+            db.rollback()
+
+    if not dry_run:
+        # journal_mode is persistent and can't change inside a transaction,
+        # set it once whenever the schema is upgraded
+        db.execute('PRAGMA journal_mode = WAL')
+
+    return migrations
@@ -0,0 +1,66 @@
+import sqlite3
+import threading
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox(object):
+    """
+    Durable queue of punches not yet delivered to a remote ledger. Punches
+    the server refused are kept in a rejected table, out of the queue.
+    """
+
+    def __init__(self, filename):
+        db = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        db.row_factory = sqlite3.Row  # Make sure we can access columns by name
+
+        db.execute('PRAGMA journal_mode = WAL')
+        db.executescript(
+            '''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id  INTEGER PRIMARY KEY,
+                day TEXT NOT NULL,
+                time TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS rejected (
+                id  INTEGER PRIMARY KEY,
+                day TEXT NOT NULL,
+                time TEXT NOT NULL,
+                reason TEXT
+            );
+            ''')
+
+        self.db = db
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def put(self, day, punch_time):
+        with self.lock:
+            self.db.execute('INSERT INTO outbox (day, time) VALUES (?,?)', (day, punch_time))
+
+    def peek(self, limit=100):
+        """ oldest queued punches, in the order they were put """
+        with self.lock:
+            return self.db.execute('SELECT * FROM outbox ORDER BY id LIMIT ?', (limit,)).fetchall()
+
+    def ack(self, last_id):
+        """ remove delivered punches up to and including last_id """
+        with self.lock:
+            self.db.execute('DELETE FROM outbox WHERE id <= ?', (last_id,))
+
+    def reject(self, last_id, reason):
+        """ move queued punches up to and including last_id to the rejected table """
+        with self.lock, self.db:
+            self.db.execute('BEGIN')
+            self.db.execute('INSERT INTO rejected (id, day, time, reason) '
+                            'SELECT id, day, time, ? FROM outbox WHERE id <= ?', (reason, last_id))
+            self.db.execute('DELETE FROM outbox WHERE id <= ?', (last_id,))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,91 @@
+import queue
+import threading
+import types
+
+from concurrent.futures import Future
+
+from .. import metrics
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LedgerWorker(object):
+    """
+    Runs every call to a ledger on a dedicated thread, in the order the calls
+    were made. Writes are queued and return at once, reads wait for their
+    result and therefore see all writes queued before them. Use submit() to
+    get a Future instead of waiting.
+    """
+    WRITES = ('in_signal', 'out_signal', 'update_in_out', 'take_a_break', 'add_note')
+
+    def __init__(self, ledger, maxsize=1000, name=None):
+        """ name labels the queue depth metric, the ledger's class name by default """
+        self.ledger = ledger
+        self._queue = queue.Queue(maxsize)
+        metrics.LEDGER_QUEUE_DEPTH.set_function(self._queue.qsize, ledger=name or type(ledger).__name__)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='bundyclock-ledger', daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        attr = getattr(self.ledger, name)
+        if not callable(attr):
+            return attr
+
+        if name in self.WRITES:
+            def write(*args, **kwargs):
+                self.submit(name, *args, **kwargs)
+            return write
+
+        def read(*args, **kwargs):
+            return self.submit(name, *args, **kwargs).result()
+        return read
+
+    def submit(self, name, *args, **kwargs):
+        """ queue ledger.name(*args, **kwargs), returns a Future for the result """
+        future = Future()
+        if self._closed:
+            logger.warning("Ledger is closed, dropping {}".format(name))
+            future.cancel()
+            return future
+
+        item = (future, name, args, kwargs)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            logger.warning("Ledger queue is full, waiting for ledger")
+            self._queue.put(item)
+
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            future, name, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with metrics.LEDGER_SECONDS.time(operation=name):
+                    result = getattr(self.ledger, name)(*args, **kwargs)
+                    if isinstance(result, types.GeneratorType):
+                        # generators must not be resumed outside this thread
+                        result = list(result)
+                future.set_result(result)
+            except Exception as e:
+                logger.exception("Ledger {} failed".format(name))
+                future.set_exception(e)
+
+    def close(self):
+        """ wait for all queued calls and close the ledger """
+        if self._closed:
+            return
+        self._closed = True
+
+        self._queue.put(None)
+        self._thread.join()
+        self.ledger.close()
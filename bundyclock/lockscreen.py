@@ -3,30 +3,94 @@ Created on Apr 4, 2013
 
 Copyright (c) 2018 Dan Hallgren  <dan.hallgren@gmail.com>
 """
-import dbus
 import logging
 import os
 import signal
-from time import sleep
+from functools import partial
+from time import monotonic
+from .eventsources import EventSource, ThreadLoop, get_source
 from .platformctx import PunchStrategy
-from .ledgers.factory import get_ledger as ledger_factory
-from .systrayapp import SystrayApp
 
 
 logger = logging.getLogger(__name__)
 
+LOGIN1 = 'org.freedesktop.login1'
+
+
+class LockScreen(EventSource):
+    """
+    Logger for lock/unlock screen. The screen saver's bus names are watched
+    from the start, so the watcher attaches as soon as one of them is owned,
+    however late in the session that is.
+    """
+    uses_dbus = True
+    # bus name, object path and whether it's unity's
+    SCREEN_SAVERS = (
+        ('com.canonical.Unity', '/com/canonical/Unity/Session', True),
+        ('org.gnome.ScreenSaver', '/org/gnome/ScreenSaver', False),
+    )
+    # seconds between the fallback checks, doubling up to the max
+    RETRY_DELAY = 0.5
+    MAX_RETRY_DELAY = 30
 
-class LockScreen(object):
-    """ Logger for lock/unlock screen """
-    def __init__(self, ledger):
-        from dbus.mainloop.glib import DBusGMainLoop
-        DBusGMainLoop(set_as_default=True)
-        from gi.repository import GObject
-        self.loop = GObject.MainLoop()
-        self.bus = dbus.SessionBus()
-        self.ledger = ledger
+    def start(self):
+        self.bus = None
+        self.screen_saver_proxy = None
+        self._watches = []
+        self._retry_delay = self.RETRY_DELAY
+        self._started = monotonic()
+        self._get_screen_saver_proxy()
+
+    def _candidates(self):
+        """ SCREEN_SAVERS, the one of this desktop session first """
+        unity_first = 'ubuntu' in os.environ.get('DESKTOP_SESSION', '')
+        return sorted(self.SCREEN_SAVERS, key=lambda screen_saver: screen_saver[2] != unity_first)
 
-        self.screen_saver_proxy, is_unity = self._get_screen_saver_proxy()
+    def _get_screen_saver_proxy(self):
+        """
+        Attach to the first screen saver found on the bus, or watch for their
+        names. The NameOwnerChanged watches attach at once when one appears,
+        the checks with backoff only cover a session bus that isn't up yet
+        and signals that went missing.
+        """
+        # D-Bus is imported on demand, a replay-only daemon runs without it
+        import dbus
+        from gi.repository import GLib
+
+        if self.screen_saver_proxy is not None:
+            return False
+
+        try:
+            if self.bus is None:
+                # When using systemd user service, the bus may not be ready yet
+                self.bus = dbus.SessionBus()
+            for bus_name, path, is_unity in self._candidates():
+                if self.bus.name_has_owner(bus_name):
+                    self._attach(bus_name, path, is_unity)
+                    return False
+            if not self._watches:
+                self._watches = [self.bus.watch_name_owner(bus_name, partial(self._name_owner_changed, bus_name))
+                                 for bus_name, _, _ in self.SCREEN_SAVERS]
+                logger.info('Waiting for a screen saver on the session bus')
+        except dbus.exceptions.DBusException as e:
+            self.bus = None
+            logger.info('Session bus not ready, retrying in {:.1f} s: {}'.format(self._retry_delay, e))
+
+        GLib.timeout_add(int(self._retry_delay * 1000), self._get_screen_saver_proxy)
+        self._retry_delay = min(self._retry_delay * 2, self.MAX_RETRY_DELAY)
+        return False
+
+    def _name_owner_changed(self, bus_name, owner):
+        if owner and self.screen_saver_proxy is None:
+            for candidate, path, is_unity in self.SCREEN_SAVERS:
+                if candidate == bus_name:
+                    self._attach(bus_name, path, is_unity)
+
+    def _attach(self, bus_name, path, is_unity):
+        self.screen_saver_proxy = self.bus.get_object(bus_name, path)
+        for watch in self._watches:
+            watch.cancel()
+        self._watches = []
 
         if is_unity is True:
             self.screen_saver_proxy.connect_to_signal('Locked', self.locked_handler, sender_keyword='sender')
@@ -37,98 +101,125 @@ class LockScreen(object):
                                                       self.gnome_handler,
                                                       dbus_interface='org.gnome.ScreenSaver')
             logger.info('Enabling gnome screen saver watcher')
-
-    def _get_screen_saver_proxy(self):
-        """ get dbus proxy object """
-        timeout = 20
-        ssp = None
-        unity = False
-
-        # When using systemd user service, we need to retry a couple of times before the bus is ready.
-        while not ssp and timeout != 0:
-
-            try:
-                if 'ubuntu' in os.environ.get('DESKTOP_SESSION'):
-                    unity = True
-            except TypeError:
-                logger.warning("Failed to get DESKTOP_SESSION env, retrying")
-                timeout -= 1
-                sleep(1)
-                continue
-
-            try:
-                if unity:
-                    ssp = self.bus.get_object('com.canonical.Unity', '/com/canonical/Unity/Session')
-                else:
-                    ssp = self.bus.get_object('org.gnome.ScreenSaver', '/org/gnome/ScreenSaver')
-            except dbus.exceptions.DBusException:
-                logger.info('Failed to get dbus object, retrying')
-                timeout -= 1
-                sleep(1)
-
-        if not ssp:
-            raise Exception("Can't connect to screen saver proxy")
-
-        return ssp, unity
+        logger.debug('Screen saver found {:.3f} s after start'.format(monotonic() - self._started))
 
     def gnome_handler(self, dbus_screen_active):
         """ handle gnome screen saver signals """
         if dbus_screen_active:
-            logger.debug('gnome: lock screen')
-            self.ledger.out_signal()
+            self.locked('gnome')
         else:
-            logger.debug('gnome: unlock screen')
-            self.ledger.in_signal()
+            self.unlocked('gnome')
 
     def locked_handler(self, sender=None):
         """ hanlde unity lock screen """
-        logger.debug('Unity: lock screen')
-        self.ledger.out_signal()
+        self.locked('unity')
 
     def unlocked_handler(self, sender=None):
         """ handle unity unlock screen """
-        logger.debug('Unity unlock screen')
-        self.ledger.in_signal()
+        self.unlocked('unity')
+
+
+class LogindSession(EventSource):
+    """
+    Lock and Unlock of the login session and PrepareForSleep from
+    systemd-logind, also without a desktop screen saver
+    """
+    uses_dbus = True
 
     def start(self):
-        """ start main loop """
-        try:
-            self.loop.run()
-        except KeyboardInterrupt:
-            self.ledger.out_signal()
-            logger.exception("KeyboardInterrrupt, shutting down")
-        logger.debug('lockscreen loop stopped')
+        import dbus
 
-    def stop(self):
-        self.loop.quit()
+        bus = dbus.SystemBus()
+        manager = dbus.Interface(bus.get_object(LOGIN1, '/org/freedesktop/login1'), LOGIN1 + '.Manager')
+
+        # a systemd user service isn't part of the session, ask logind for the user's display session
+        session_id = os.environ.get('XDG_SESSION_ID') or bus.get_object(
+            LOGIN1, '/org/freedesktop/login1/session/auto').Get(
+                LOGIN1 + '.Session', 'Id', dbus_interface=dbus.PROPERTIES_IFACE)
+        session_path = manager.GetSession(session_id)
+
+        bus.add_signal_receiver(self.lock_handler, 'Lock', LOGIN1 + '.Session', LOGIN1, session_path)
+        bus.add_signal_receiver(self.unlock_handler, 'Unlock', LOGIN1 + '.Session', LOGIN1, session_path)
+        manager.connect_to_signal('PrepareForSleep', self.sleep_handler)
+        logger.info('Enabling logind watcher of session {}'.format(session_id))
+
+    def lock_handler(self):
+        self.locked('logind')
+
+    def unlock_handler(self):
+        self.unlocked('logind')
+
+    def sleep_handler(self, going_to_sleep):
+        if going_to_sleep:
+            self.locked('logind')
+        else:
+            self.unlocked('logind')
 
 
 class LinuxStrategy(PunchStrategy):
     def __init__(self, **kwargs):
         self.config = kwargs
-        self.ledger = ledger_factory(**self.config)
-        self.ledger.in_signal()
+        self._setup_punches()
+        self.sources = [get_source(spec, self.punches, done=self.stop)
+                        for spec in self.config.get('event_sources', 'screensaver').split(',')]
+        self.loop = None
 
-        self.app = SystrayApp(ledger=self.ledger, actioncb=self.action)
+        self.app = None
+        if self.config.get('systray', 'yes').lower() not in ('no', 'false', 'off', '0'):
+            # needs a display, imported only when shown
+            from .systrayapp import SystrayApp
+            self.app = SystrayApp(ledger=self.punches, actioncb=self.action, today=self.today)
 
         # Register sigterm handler
         signal.signal(signal.SIGTERM, self.sigterm_handler)
 
     def action(self, query):
         if query == 'quit':
-            self.lockscreen.stop()
+            self.loop.quit()
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.quit()
+        if self.app is not None:
+            self.app.stop()
 
     def sigterm_handler(self, *args, **kwargs):
         """ Gracefully shutdown, put last entry to time logger"""
+        self.punches.flush()
         self.ledger.out_signal()
-        self.lockscreen.stop()
-        self.app.stop()
+        self.ledger.close()
+        self.stop()
         logger.info("Killed by sigterm, shutting down")
 
-    def setup_lockscreen_loop(self, icon):
-        self.lockscreen = LockScreen(self.ledger)
-        icon.visible = True
-        self.lockscreen.start()
+    def setup_lockscreen_loop(self, icon=None):
+        if any(source.uses_dbus for source in self.sources):
+            from dbus.mainloop.glib import DBusGMainLoop
+            DBusGMainLoop(set_as_default=True)
+            from gi.repository import GObject
+            self.loop = GObject.MainLoop()
+        else:
+            self.loop = ThreadLoop()
+
+        for source in self.sources:
+            source.start()
+        if icon is not None:
+            icon.visible = True
+            self.app.start_ticking()
+
+        try:
+            self.loop.run()
+        except KeyboardInterrupt:
+            self.punches.out_signal()
+            logger.exception("KeyboardInterrrupt, shutting down")
+
+        for source in self.sources:
+            source.stop()
+        logger.debug('lockscreen loop stopped')
 
     def run(self):
-        self.app.run(self.setup_lockscreen_loop)
+        if self.app is not None:
+            self.app.run(self.setup_lockscreen_loop)
+        else:
+            self.setup_lockscreen_loop()
+        self.punches.flush()
+        self.ledger.close()
@@ -0,0 +1,223 @@
+"""
+Operation counters and latency histograms for the daemon, exported in the
+Prometheus text format to a stats file and/or a UNIX socket.
+"""
+import os
+import socketserver
+import threading
+import time
+
+from contextlib import contextmanager
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in pairs) + '}'
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return ['{}{} {}'.format(self.name, _format_labels(self.labels, key), value)
+                for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._functions = {}
+
+    def set_function(self, function, **labels):
+        """ the gauge value of labels is read from function when rendered """
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def _samples(self):
+        samples = []
+        for key, function in sorted(self._functions.items()):
+            try:
+                samples.append('{}{} {}'.format(self.name, _format_labels(self.labels, key), function()))
+            except Exception:
+                logger.debug("Failed to read gauge {}".format(self.name), exc_info=True)
+        return samples
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        self._values = {}
+
+    def observe(self, seconds, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                # [bucket counts, sum, count]
+                self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            value = self._values[key]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    value[0][i] += 1
+            value[1] += seconds
+            value[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        samples = []
+        for key, (counts, total, count) in sorted(self._values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                samples.append('{}_bucket{} {}'.format(
+                    self.name, _format_labels(self.labels, key, [('le', bound)]), bucket_count))
+            samples.append('{}_bucket{} {}'.format(
+                self.name, _format_labels(self.labels, key, [('le', '+Inf')]), count))
+            samples.append('{}_sum{} {}'.format(self.name, _format_labels(self.labels, key), total))
+            samples.append('{}_count{} {}'.format(self.name, _format_labels(self.labels, key), count))
+        return samples
+
+
+EVENTS = Counter('bundyclock_events_total', 'Lock screen and menu events handled', ('event',))
+FILTERED_EVENTS = Counter('bundyclock_filtered_events_total', 'Lock screen events not written to the ledger')
+HANDLER_SECONDS = Histogram('bundyclock_handler_seconds', 'Time spent in event handlers', ('handler',))
+LEDGER_SECONDS = Histogram('bundyclock_ledger_seconds', 'Ledger operation latency', ('operation',))
+LEDGER_QUEUE_DEPTH = Gauge('bundyclock_ledger_queue_depth', 'Calls waiting for the ledger worker', ('ledger',))
+COMMITS = Counter('bundyclock_commits_total', 'Ledger commits to storage')
+HTTP_SECONDS = Histogram('bundyclock_http_request_seconds', 'REST API request latency', ('method',))
+HTTP_RETRIES = Counter('bundyclock_http_retries_total', 'Outbox deliveries failed and left for retry')
+HTTP_REJECTED = Counter('bundyclock_http_rejected_total', 'Outbox deliveries refused by the server and moved aside')
+OUTBOX_DEPTH = Gauge('bundyclock_outbox_depth', 'Punches waiting in the http-rest outbox')
+
+
+def render():
+    """ all metrics in the Prometheus text exposition format """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class StatsFileWriter(object):
+    """ Rewrites the stats file every interval seconds, e.g. for node_exporter's textfile collector """
+
+    def __init__(self, filename, interval=15):
+        self.filename = filename
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='bundyclock-metrics', daemon=True)
+        self._thread.start()
+
+    def write(self):
+        tmp_file = self.filename + '.tmp'
+        with open(tmp_file, 'w') as s:
+            s.write(render())
+        os.replace(tmp_file, self.filename)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                logger.warning("Failed to write metrics: {}".format(e))
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.write()
+
+
+class _MetricsHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # Answer any request, HTTP or not, with the metrics
+        request_line = self.rfile.readline()
+        body = render().encode()
+        if request_line.startswith(b'GET'):
+            self.wfile.write(b'HTTP/1.0 200 OK\r\n'
+                             b'Content-Type: text/plain; version=0.0.4\r\n'
+                             b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n')
+        self.wfile.write(body)
+
+
+class MetricsSocketServer(object):
+    """
+    Serves the metrics on a UNIX socket, e.g.
+
+        curl --unix-socket metrics.sock http://localhost/metrics
+    """
+    def __init__(self, path):
+        if not hasattr(socketserver, 'UnixStreamServer'):
+            raise OSError('UNIX sockets not supported')
+        if os.path.exists(path):
+            os.unlink(path)
+        self.path = path
+        self._server = socketserver.ThreadingUnixStreamServer(path, _MetricsHandler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='bundyclock-metrics-socket',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        os.unlink(self.path)
+
+
+def start_exporters(metrics_file=None, metrics_socket=None, interval=15):
+    """ start the configured exporters, returns them so they can be stopped """
+    exporters = []
+    if metrics_file:
+        exporters.append(StatsFileWriter(metrics_file, interval))
+    if metrics_socket:
+        exporters.append(MetricsSocketServer(metrics_socket))
+    return exporters
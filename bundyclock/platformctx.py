@@ -1,5 +1,10 @@
 from abc import ABC, abstractmethod
 
+from .punchfilter import PunchFilter
+from .today import TodaySummary
+from .ledgers.factory import get_ledger as ledger_factory
+from .ledgers.worker import LedgerWorker
+
 
 class PunchStrategy(ABC):
     """
@@ -15,6 +20,25 @@ class PunchStrategy(ABC):
     def run(self):
         pass
 
+    def _setup_punches(self, punch_in=True):
+        """ ledger worker, today's summary and punch filter of self.config, punch_in at start """
+        self.ledger = LedgerWorker(ledger_factory(**self.config))
+        self.today = TodaySummary()
+        if punch_in:
+            self.ledger.in_signal()
+            self.today.punch(True)
+        self.ledger.submit('get_today').add_done_callback(self._seed_today)
+        # lock screen and menu events, the control socket punches the ledger directly
+        self.punches = PunchFilter(self.ledger,
+                                   min_away=self.config.get('min_away', 60),
+                                   coalesce_window=self.config.get('coalesce_window', 5),
+                                   today=self.today)
+
+    def _seed_today(self, future):
+        """ pick up a day begun before the daemon started """
+        if not future.cancelled() and future.exception() is None:
+            self.today.seed(future.result())
+
 
 class PlatformCtx():
     """
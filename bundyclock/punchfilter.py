@@ -0,0 +1,131 @@
+"""
+Debouncing of lock screen events on their way to the ledger.
+
+Screen savers flap, monitors wake up one after the other and a lock is
+often followed by an unlock a few seconds later. A lock is only written
+once the screen has stayed locked for min_away seconds and an unlock once
+the screen hasn't been locked again within coalesce_window seconds. A
+lock and unlock within those times cancel each other out. What is written
+carries the time of the original event, so the ledger reads as if every
+event had been written, less the short absences.
+"""
+import threading
+import time
+
+from . import metrics
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+PRESENT = 'present'
+AWAY = 'away'
+
+
+def _day(now=None):
+    return time.strftime('%Y-%m-%d', time.localtime(now))
+
+
+class PunchFilter(object):
+    """
+    Stands in for the ledger in the lock screen handlers. in_signal and
+    out_signal are debounced, everything else goes straight to the ledger.
+    What is written is also passed on to the today summary, if given.
+    """
+    def __init__(self, ledger, min_away=60, coalesce_window=5, today=None):
+        self.ledger = ledger
+        self.today = today
+        self._delays = {AWAY: float(min_away), PRESENT: float(coalesce_window)}
+        self._lock = threading.Lock()
+        # presence as written to the ledger and its day, the daemon punches in on start
+        self._state = PRESENT
+        self._day = _day()
+        # (state, now) of the event waiting for its delay, and its timer
+        self._pending = None
+        self._timer = None
+        self._break_taken = False
+
+    def __getattr__(self, name):
+        return getattr(self.ledger, name)
+
+    # events are at now, seconds since the epoch, e.g. a recorded time, or at the current time
+
+    def in_signal(self, now=None):
+        self._event(PRESENT, now)
+
+    def out_signal(self, now=None):
+        self._event(AWAY, now)
+
+    def take_a_break(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._expire(now)
+            self._break_taken = True
+        self.ledger.take_a_break(now=now)
+        if self.today is not None:
+            self.today.take_a_break(now)
+
+    def _event(self, state, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._expire(now)
+            if self._pending is not None:
+                if self._pending[0] == state:
+                    # repeated signal, the first one has the time
+                    metrics.FILTERED_EVENTS.inc()
+                    return
+                self._timer.cancel()
+                self._pending = self._timer = None
+                logger.debug("Back within the debounce time, nothing to write")
+                metrics.FILTERED_EVENTS.inc(2)
+                if state == PRESENT and self._break_taken:
+                    # a short absence still ends a break
+                    self._write(state, now)
+                return
+
+            if state == self._state and _day(now) == self._day:
+                # on another day it's the first punch of that day
+                metrics.FILTERED_EVENTS.inc()
+                return
+
+            if not self._delays[state]:
+                self._write(state, now)
+                return
+
+            pending = self._pending = (state, now)
+            self._timer = threading.Timer(self._delays[state], self._timed_write, args=(pending,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _expire(self, now):
+        """ Write the waiting event if its delay is over by now, before its timer has fired """
+        if self._pending is not None and now - self._pending[1] >= self._delays[self._pending[0]]:
+            self._timer.cancel()
+            pending, self._pending, self._timer = self._pending, None, None
+            self._write(*pending)
+
+    def _timed_write(self, pending):
+        with self._lock:
+            # cancelled after the timer fired
+            if self._pending is pending:
+                self._pending = self._timer = None
+                self._write(*pending)
+
+    def _write(self, state, now):
+        if state == PRESENT:
+            self.ledger.in_signal(now=now)
+            self._break_taken = False
+        else:
+            self.ledger.out_signal(now=now)
+        self._state = state
+        self._day = _day(now)
+        if self.today is not None:
+            self.today.punch(state == PRESENT, now)
+
+    def flush(self):
+        """ Write the waiting event at once """
+        with self._lock:
+            if self._pending is not None:
+                self._timer.cancel()
+                pending, self._pending, self._timer = self._pending, None, None
+                self._write(*pending)
@@ -1,61 +1,183 @@
+import datetime
+import os
 import re
 
 from calendar import monthrange
+from itertools import groupby
 
 import jinja2
 
+from .ledgers.ledgers import PunchTime, hms_to_seconds, seconds_to_hms
+
 
 # jinja2 filters
 def _subtract_minutes(time_hms, minute_subtrahend):
     """"
     jinja2 filter that subtracts given minutes from time in HH:MM:SS format
     """
-    (h, m, s) = map(int, time_hms.split(':'))
-    seconds = h * 3600 + m * 60 + s - minute_subtrahend * 60
-
-    return _sec2str(seconds)
+    return _sec2str(hms_to_seconds(time_hms) - minute_subtrahend * 60)
 
 
 def _sec2str(seconds):
     try:
-        h, s = divmod(seconds, 3600)
-        m, s = divmod(s, 60)
+        return seconds_to_hms(seconds)
     except TypeError:
-        (h, m, s) = (0, 0, 0)
-
-    return "%02d:%02d:%02d" % (h, m, s)
+        return seconds_to_hms(0)
 
 
 def _str2sec(time_hms):
-    (h, m, s) = map(int, time_hms.split(':'))
-    seconds = h * 3600 + m * 60 + s
+    return hms_to_seconds(time_hms)
 
-    return seconds
 
+# process-wide environment, compiled templates are cached by jinja2
+# one environment per bytecode cache directory
+_template_envs = {}
 
-def render(year_month, ledger, template):
+
+def get_environment(bytecode_cache_dir=None):
+    """
+    The report template environment, created on first use. With
+    bytecode_cache_dir set, compiled templates are also cached on disk
+    between runs.
+    """
+    env = _template_envs.get(bytecode_cache_dir)
+    if env is None:
+        bytecode_cache = None
+        if bytecode_cache_dir:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+            bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache_dir)
+
+        env = jinja2.Environment(
+            loader=jinja2.ChoiceLoader([
+                jinja2.PackageLoader('bundyclock', 'templates'),
+                jinja2.FileSystemLoader(searchpath="./"),
+            ]),
+            bytecode_cache=bytecode_cache,
+        )
+        env.filters['lunch'] = _subtract_minutes
+        env.filters['sec2str'] = _sec2str
+        env.filters['str2sec'] = _str2sec
+        _template_envs[bytecode_cache_dir] = env
+
+    return env
+
+
+def generate(year_month, ledger, template, bytecode_cache_dir=None):
+    """ render the report, yielding the text in chunks as it is produced """
     start_date = re.sub(r'(\d{4})-(\d{2}).*', r'\1-\2-01', year_month)
     last_day_of_month = monthrange(*map(int, year_month.split('-')[:2]))[1]
     end_date = re.sub(r'(\d{4})-(\d{2}).*', r'\1-\2-{}', year_month) \
         .format(last_day_of_month)
 
-    try:
-        template_env = jinja2.Environment(loader=jinja2.PackageLoader('bundyclock', 'templates'))
-    except jinja2.exceptions.TemplateNotFound:
-        template_env = jinja2.Environment(loader=jinja2.FileSystemLoader(searchpath="./"))
-
-    template_env.filters['lunch'] = _subtract_minutes
-    template_env.filters['sec2str'] = _sec2str
-    template_env.filters['str2sec'] = _str2sec
-    template = template_env.get_template(template)
+    template = get_environment(bytecode_cache_dir).get_template(template)
 
     totals = ledger.get_total_report(start_date, end_date)
     context = dict(
         month=end_date,
         total_month=_sec2str(totals['total_day']),
         totals=totals,
-        workdays=ledger.get_month(year_month)
+        workdays=map(PunchTime.from_row, ledger.get_month(year_month))
     )
-    rendered_report = template.render(context)
 
-    return rendered_report
+    return template.generate(context)
+
+
+def render(year_month, ledger, template, bytecode_cache_dir=None):
+    return ''.join(generate(year_month, ledger, template, bytecode_cache_dir))
+
+
+class _Totals(object):
+    """ running totals, complete once the workdays passed to it have been iterated """
+
+    def __init__(self):
+        self.num_days = 0
+        self.total_day = 0
+        self.total_break = 0
+
+    def add(self, workday):
+        self.num_days += 1
+        self.total_day += workday.total_secs
+        self.total_break += workday.break_secs
+
+
+def _counted(workdays, *totals):
+    for workday in workdays:
+        for t in totals:
+            t.add(workday)
+        yield workday
+
+
+def _months(workdays, totals):
+    for month, month_workdays in groupby(workdays, key=lambda workday: workday.day[:7]):
+        month_totals = _Totals()
+        yield dict(
+            month=month,
+            totals=month_totals,
+            workdays=_counted(month_workdays, month_totals, totals),
+        )
+
+
+def generate_range(start_date, end_date, ledger, template, bytecode_cache_dir=None):
+    """
+    render a report over several months, yielding the text in chunks. All
+    workdays are fetched by a single ledger call and subtotals are summed up
+    while the rows are rendered.
+    """
+    template = get_environment(bytecode_cache_dir).get_template(template)
+
+    totals = _Totals()
+    context = dict(
+        start_date=start_date,
+        end_date=end_date,
+        totals=totals,
+        months=_months(map(PunchTime.from_row, ledger.get_range(start_date, end_date)), totals),
+    )
+
+    return template.generate(context)
+
+
+def parse_period(period):
+    """
+    First and last month (YYYY-MM) of a --report argument, either a
+    month, a range of months 'first..last' or a year 'YYYY'. A year as
+    the first or last month of a range is its January or December.
+    """
+    from dateutil.parser import parse as guess_date
+
+    default = datetime.datetime.now().replace(day=1)
+
+    def month(bound, year_month):
+        if re.fullmatch(r'\d{4}', bound.strip()):
+            return '{}-{}'.format(bound.strip(), year_month)
+        return guess_date(bound, default=default).strftime('%Y-%m')
+
+    first, sep, last = period.partition('..')
+    if not sep:
+        last = first
+    first, last = month(first, '01'), month(last, '12')
+    if first > last:
+        raise ValueError('Period "{}" ends before it starts'.format(period))
+
+    return first, last
+
+
+def period_dates(period):
+    """ First and last day (YYYY-MM-DD) of a --report argument """
+    first, last = parse_period(period)
+    last_day_of_month = monthrange(*map(int, last.split('-')))[1]
+    return first + '-01', '{}-{:02d}'.format(last, last_day_of_month)
+
+
+def generate_period(period, ledger, settings):
+    """
+    render the report for a --report argument with the templates from the
+    bundyclock config section settings, yielding the text in chunks
+    """
+    first, last = parse_period(period)
+    bytecode_cache_dir = settings.get('template_cache')
+
+    if first == last:
+        return generate(first, ledger, settings.get('template', 'default_report.j2'), bytecode_cache_dir)
+
+    return generate_range(*period_dates(period), ledger,
+                          settings.get('range_template', 'default_range_report.j2'), bytecode_cache_dir)
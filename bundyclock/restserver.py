@@ -0,0 +1,379 @@
+"""
+Self-hosted server for the REST API used by the http-rest ledger.
+
+Every user has a sqlite ledger of their own in the data dir and is
+addressed by the first path segment, point a client's url to
+
+    http://<host>:<port>/<user>/workdays/
+
+Served are <user>/workdays/ (GET with start_date/end_date filters, POST of
+a workday or a JSON list of workdays), <user>/workdays/<YYYY-MM-DD>/ (GET,
+PUT) and <user>/workdays/total_sum/ (GET with start_date/end_date filters).
+
+A single thread waits for requests on all connections and hands each
+request to a fixed pool of workers, so idle keep-alive clients don't tie up
+a worker. Workers keep their ledger connections open between requests.
+There is no authentication, put it behind a reverse proxy that has.
+"""
+import argparse
+import collections
+import json
+import os
+import queue
+import re
+import selectors
+import socket
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qsl, urlsplit
+
+from .ledgers.dbledger import SqLiteOutput
+from .ledgers.ledgers import hms_to_seconds, seconds_to_hms
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+USER = re.compile(r'[A-Za-z0-9_-][A-Za-z0-9_.-]*')
+DAY = re.compile(r'\d{4}-\d{2}-\d{2}')
+WORKDAY_FIELDS = ('date', 'intime', 'outtime', 'total', 'num_breaks', 'break_secs')
+
+
+class ApiError(Exception):
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class WorkdayStore(object):
+    """
+    Per-user sqlite ledgers in data_dir. Each thread keeps up to
+    max_open ledgers open and reuses them, least recently used first out.
+    """
+    def __init__(self, data_dir, max_open=32):
+        self.data_dir = data_dir
+        self.max_open = max_open
+        self._local = threading.local()
+
+    def ledger(self, user, create=False):
+        """ the user's ledger, a new one with create, otherwise an unknown user is not found """
+        if not USER.fullmatch(user):
+            raise ApiError(HTTPStatus.NOT_FOUND, 'Not found.')
+
+        ledgers = getattr(self._local, 'ledgers', None)
+        if ledgers is None:
+            ledgers = self._local.ledgers = collections.OrderedDict()
+
+        ledger = ledgers.get(user)
+        if ledger is not None:
+            ledgers.move_to_end(user)
+            return ledger
+
+        filename = os.path.join(self.data_dir, user + '.db')
+        if not create and not os.path.exists(filename):
+            raise ApiError(HTTPStatus.NOT_FOUND, 'Not found.')
+
+        if len(ledgers) >= self.max_open:
+            _, evicted = ledgers.popitem(last=False)
+            self._close(evicted)
+
+        ledger = SqLiteOutput(filename)
+        # wait for other workers' writes instead of failing
+        ledger.db.execute('PRAGMA busy_timeout = 10000')
+        ledger.db.execute('PRAGMA synchronous = NORMAL')
+        ledgers[user] = ledger
+        return ledger
+
+    @staticmethod
+    def _close(ledger):
+        ledger.close()
+        ledger.db.close()
+
+    @staticmethod
+    def _workday(row):
+        return dict(zip(WORKDAY_FIELDS, (row['day'], row['intime'], row['outtime'], row['total'],
+                                         row['num_breaks'], row['break_secs'])))
+
+    def list(self, user, start_date=None, end_date=None):
+        rows = self.ledger(user).get_range(start_date or '0000-00-00', end_date or '9999-99-99')
+        return [self._workday(row) for row in rows]
+
+    def get(self, user, day):
+        for row in self.ledger(user).get_range(day, day):
+            return self._workday(row)
+        raise ApiError(HTTPStatus.NOT_FOUND, 'Not found.')
+
+    def create(self, user, workdays):
+        """ insert all workdays or, if any of the days exist, none """
+        rows = []
+        for workday in workdays:
+            day, intime, outtime = self._validate(workday, workday.get('date'))
+            rows.append((day, intime, outtime, SqLiteOutput.calc_tot_time(intime, outtime)))
+
+        db = self.ledger(user, create=True).db
+        try:
+            with db:
+                db.executemany('INSERT INTO workdays (day, intime, outtime, total) VALUES (?,?,?,?)', rows)
+        except db.IntegrityError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, {'date': ['workday with this date already exists.']})
+
+        return [self.get(user, row[0]) for row in rows]
+
+    def update(self, user, day, workday):
+        current = self.get(user, day)
+        day, intime, outtime = self._validate(dict(current, **workday), day)
+
+        db = self.ledger(user).db
+        with db:
+            db.execute('UPDATE workdays SET intime = ?, outtime = ?, total = ? WHERE day = ?',
+                       (intime, outtime, SqLiteOutput.calc_tot_time(intime, outtime), day))
+        return self.get(user, day)
+
+    def total_sum(self, user, start_date=None, end_date=None):
+        totals = self.ledger(user).get_total_report(start_date, end_date)
+        return dict(total_day=totals['total_day'] or 0, total_break=totals['total_break'] or 0)
+
+    @staticmethod
+    def _validate(workday, day):
+        errors = {}
+        if not isinstance(day, str) or not DAY.fullmatch(day):
+            errors['date'] = ['Enter a valid date, YYYY-MM-DD.']
+        times = []
+        for field in ('intime', 'outtime'):
+            try:
+                seconds = hms_to_seconds(workday.get(field))
+                if not 0 <= seconds < 24 * 3600:
+                    raise ValueError(seconds)
+                # stored as HH:MM:SS
+                times.append(seconds_to_hms(seconds))
+            except (AttributeError, ValueError):
+                errors[field] = ['Enter a valid time, hh:mm:ss.']
+        if errors:
+            raise ApiError(HTTPStatus.BAD_REQUEST, errors)
+        return (day, *times)
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """
+    Serves one request at a time off a kept-alive connection, see ApiServer
+    """
+    protocol_version = 'HTTP/1.1'
+    server_version = 'bundyclock'
+
+    def __init__(self, connection, client_address, server):
+        # the connection outlives single requests, see handle_next()
+        self.request = self.connection = connection
+        self.client_address = client_address
+        self.server = server
+        self.rfile = connection.makefile('rb')
+        self.wfile = connection.makefile('wb')
+        self.last_active = time.monotonic()
+
+    def handle_next(self):
+        """ serve the next request, returns True if the connection is kept alive """
+        self.close_connection = True
+        self.handle_one_request()
+        self.last_active = time.monotonic()
+        return not self.close_connection
+
+    def close(self):
+        for f in (self.rfile, self.wfile):
+            try:
+                f.close()
+            except OSError:
+                pass
+        self.connection.close()
+
+    def log_message(self, format, *args):
+        logger.debug("{} {}".format(self.address_string(), format % args))
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length).decode()
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                return json.loads(data)
+            except ValueError:
+                raise ApiError(HTTPStatus.BAD_REQUEST, 'JSON parse error.')
+        return dict(parse_qsl(data))
+
+    def _route(self):
+        """ (user, item, query) of <user>/workdays/[<item>/] """
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        if len(parts) not in (2, 3) or parts[1] != 'workdays':
+            raise ApiError(HTTPStatus.NOT_FOUND, 'Not found.')
+        return parts[0], parts[2] if len(parts) == 3 else None, dict(parse_qsl(url.query))
+
+    def _dispatch(self, method):
+        try:
+            user, item, query = self._route()
+            self._reply(*method(self.server.store, user, item, query))
+        except ApiError as e:
+            self._reply(e.status, {'detail': e.detail} if isinstance(e.detail, str) else e.detail)
+        except Exception:
+            logger.exception("Failed to serve {} {}".format(self.command, self.path))
+            self._reply(HTTPStatus.INTERNAL_SERVER_ERROR, {'detail': 'Server error.'})
+
+    def do_GET(self):
+        def get(store, user, item, query):
+            range_ = (query.get('start_date'), query.get('end_date'))
+            for day in range_:
+                if day is not None and not DAY.fullmatch(day):
+                    raise ApiError(HTTPStatus.BAD_REQUEST, 'Enter a valid date, YYYY-MM-DD.')
+            if item is None:
+                return HTTPStatus.OK, store.list(user, *range_)
+            if item == 'total_sum':
+                # current month unless given
+                return HTTPStatus.OK, {'total_sum': store.total_sum(user, *range_)}
+            return HTTPStatus.OK, store.get(user, item)
+        self._dispatch(get)
+
+    def do_POST(self):
+        def post(store, user, item, query):
+            if item is not None:
+                raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED, 'Method "POST" not allowed.')
+            body = self._body()
+            if isinstance(body, list):
+                return HTTPStatus.CREATED, store.create(user, body)
+            return HTTPStatus.CREATED, store.create(user, [body])[0]
+        self._dispatch(post)
+
+    def do_PUT(self):
+        def put(store, user, item, query):
+            if item is None or item == 'total_sum':
+                raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED, 'Method "PUT" not allowed.')
+            body = self._body()
+            if not isinstance(body, dict):
+                raise ApiError(HTTPStatus.BAD_REQUEST, 'Expected a workday.')
+            return HTTPStatus.OK, store.update(user, item, body)
+        self._dispatch(put)
+
+
+class ApiServer(object):
+    """
+    Accepts connections and waits for their requests in one thread, every
+    request is served by one of `workers` threads. Connections idle for
+    more than idle_timeout seconds are closed.
+    """
+    def __init__(self, address, data_dir, workers=16, idle_timeout=30.0, request_timeout=10.0):
+        os.makedirs(data_dir, exist_ok=True)
+        self.store = WorkdayStore(data_dir, max_open=32)
+        self.idle_timeout = idle_timeout
+        self.request_timeout = request_timeout
+
+        self.socket = socket.create_server(address, backlog=1024)
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.socket, selectors.EVENT_READ)
+        # workers hand kept-alive connections back to the selector thread through this
+        self._returned = queue.SimpleQueue()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='bundyclock-api')
+        self._stopped = threading.Event()
+        self._next_idle_check = 0
+
+    def serve_forever(self):
+        logger.info("Serving the workdays API on {}:{}".format(*self.server_address[:2]))
+        while not self._stopped.is_set():
+            for key, _ in self._selector.select(timeout=1.0):
+                if key.fileobj is self.socket:
+                    self._accept()
+                elif key.fileobj is self._wakeup_r:
+                    self._wakeup_r.recv(4096)
+                    while not self._returned.empty():
+                        handler = self._returned.get()
+                        self._selector.register(handler.connection, selectors.EVENT_READ, handler)
+                else:
+                    self._selector.unregister(key.fileobj)
+                    self._pool.submit(self._serve, key.data)
+            if time.monotonic() >= self._next_idle_check:
+                self._close_idle()
+                self._next_idle_check = time.monotonic() + 1.0
+
+    def _accept(self):
+        while True:
+            try:
+                connection, client_address = self.socket.accept()
+            except BlockingIOError:
+                return
+            connection.settimeout(self.request_timeout)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            handler = ApiHandler(connection, client_address, self)
+            self._selector.register(connection, selectors.EVENT_READ, handler)
+
+    def _serve(self, handler):
+        try:
+            keep_alive = handler.handle_next()
+        except Exception:
+            logger.debug("Connection from {} failed".format(handler.client_address), exc_info=True)
+            keep_alive = False
+
+        if keep_alive and not self._stopped.is_set():
+            self._returned.put(handler)
+            self._wakeup_w.send(b'\0')
+        else:
+            handler.close()
+
+    def _close_idle(self):
+        deadline = time.monotonic() - self.idle_timeout
+        for key in list(self._selector.get_map().values()):
+            if isinstance(key.data, ApiHandler) and key.data.last_active < deadline:
+                self._selector.unregister(key.fileobj)
+                key.data.close()
+
+    def shutdown(self):
+        """ stop serve_forever, may be called from any thread """
+        self._stopped.set()
+        self._wakeup_w.send(b'\0')
+
+    def server_close(self):
+        self._pool.shutdown(wait=True)
+        for key in list(self._selector.get_map().values()):
+            if isinstance(key.data, ApiHandler):
+                key.data.close()
+        self._selector.close()
+        self.socket.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bundyclock workdays REST API server')
+    parser.add_argument('--bind', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--data-dir', default='bundyclock-data', help='dir of the per-user databases')
+    parser.add_argument('--workers', type=int, default=16, help='requests served concurrently')
+    parser.add_argument('--idle-timeout', type=float, default=30.0,
+                        help='seconds before idle keep-alive connections are closed')
+    args = parser.parse_args()
+
+    server = ApiServer((args.bind, args.port), args.data_dir, args.workers, args.idle_timeout)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Statistics over the workday history: arrival and leave times, worked
+hours per week and month, overtime against a daily target and breaks.
+
+The ledger is read once into NumPy arrays and everything is computed on
+whole columns, so decades of history take no longer than a month.
+NumPy is an optional dependency, pip install bundyclock[stats]
+"""
+import numpy as np
+
+from .ledgers.ledgers import PunchTime, seconds_to_hms
+
+PERCENTILES = (10, 50, 90)
+
+
+class History(object):
+    """ Workday columns as arrays, one element per day """
+    def __init__(self, workdays):
+        columns = [(w.day, w.in_secs, w.out_secs, w.total_secs, w.num_breaks, w.break_secs or 0)
+                   for w in map(PunchTime.from_row, workdays)]
+        days, in_secs, out_secs, total_secs, num_breaks, break_secs = zip(*columns) if columns else [()] * 6
+
+        self.days = np.array([day[:10].replace('.', '-') for day in days], dtype='datetime64[D]')
+        self.in_secs = np.array(in_secs, dtype=np.int64)
+        self.out_secs = np.array(out_secs, dtype=np.int64)
+        self.total_secs = np.array(total_secs, dtype=np.int64)
+        self.num_breaks = np.array(num_breaks, dtype=np.int64)
+        self.break_secs = np.array(break_secs, dtype=np.int64)
+        self.worked_secs = self.total_secs - self.break_secs
+
+    def __len__(self):
+        return len(self.days)
+
+    def weeks(self):
+        """ monday of the week of every day """
+        # 1970-01-01, day 0, was a thursday
+        return self.days - (self.days.astype(np.int64) + 3) % 7
+
+    def months(self):
+        return self.days.astype('datetime64[M]')
+
+
+def _distribution(values):
+    """ (mean, p10, p50, p90) of values """
+    return (values.mean(),) + tuple(np.percentile(values, PERCENTILES))
+
+
+def _per_period(keys, history, target_secs):
+    """ (period, days, worked, overtime) for every distinct key, in order """
+    periods, index = np.unique(keys, return_inverse=True)
+    days = np.bincount(index)
+    worked = np.bincount(index, weights=history.worked_secs).astype(np.int64)
+    return periods, days, worked, worked - days * target_secs
+
+
+def compute(history, target_secs):
+    """ dict of all statistics of history, durations and times in seconds """
+    weeks, week_days, week_worked, week_overtime = _per_period(history.weeks(), history, target_secs)
+    months, month_days, month_worked, month_overtime = _per_period(history.months(), history, target_secs)
+    with_breaks = history.num_breaks > 0
+    num_breaks = np.bincount(np.minimum(history.num_breaks, 3), minlength=4)
+
+    return dict(
+        first=str(history.days.min()),
+        last=str(history.days.max()),
+        days=len(history),
+        weeks=len(weeks),
+        target=target_secs,
+        arrival=_distribution(history.in_secs),
+        leave=_distribution(history.out_secs),
+        worked_day=_distribution(history.worked_secs),
+        worked_week=_distribution(week_worked),
+        worked_month=_distribution(month_worked),
+        overtime=int(week_overtime.sum()),
+        overtime_week=_distribution(week_overtime),
+        break_day=_distribution(history.break_secs),
+        break_length=(_distribution(history.break_secs[with_breaks] / history.num_breaks[with_breaks])
+                      if with_breaks.any() else None),
+        num_breaks=num_breaks / len(history),
+        months=list(zip((str(m) for m in months), month_days.tolist(), month_worked.tolist(),
+                        month_overtime.tolist())),
+    )
+
+
+def _hms(seconds):
+    """ HH:MM:SS, with a sign when negative """
+    seconds = int(round(seconds))
+    return ('-' if seconds < 0 else '') + seconds_to_hms(abs(seconds))
+
+
+def _signed(seconds):
+    return _hms(seconds) if seconds < 0 else '+' + _hms(seconds)
+
+
+def format_stats(stats):
+    """ text of the statistics from compute() """
+    def row(label, distribution, fmt=_hms):
+        if distribution is None:
+            return '{:<16}{:>12}'.format(label, '-')
+        return '{:<16}'.format(label) + ''.join('{:>12}'.format(fmt(v)) for v in distribution)
+
+    lines = [
+        'Statistics {first} - {last}, {days} days in {weeks} weeks'.format(**stats),
+        '=' * 64,
+        '{:<16}{:>12}'.format('', 'mean') + ''.join('{:>12}'.format('p{}'.format(p)) for p in PERCENTILES),
+        row('Arrival', stats['arrival']),
+        row('Leave', stats['leave']),
+        row('Worked / day', stats['worked_day']),
+        row('Worked / week', stats['worked_week']),
+        row('Worked / month', stats['worked_month']),
+        row('Overtime / week', stats['overtime_week'], _signed),
+        row('Breaks / day', stats['break_day']),
+        row('Break length', stats['break_length']),
+        '',
+        'Overtime against {} a day: {}'.format(_hms(stats['target']), _signed(stats['overtime'])),
+        'Days with 0, 1, 2, 3+ breaks: {}'.format(
+            ', '.join('{:.0%}'.format(share) for share in stats['num_breaks'])),
+        '',
+        '{:<10}{:>6}{:>14}{:>14}'.format('Month', 'Days', 'Worked', 'Overtime'),
+        '-' * 44,
+    ]
+    lines.extend('{:<10}{:>6}{:>14}{:>14}'.format(month, days, _hms(worked), _signed(overtime))
+                 for month, days, worked, overtime in stats['months'])
+
+    return '\n'.join(lines)
+
+
+def generate(start_date, end_date, ledger, target_secs):
+    """
+    text of the statistics for the workdays between start_date and end_date,
+    None when there are none. Raises IOError if the ledger couldn't be read
+    """
+    rows = ledger.get_range(start_date, end_date)
+    if rows is None:
+        # the http-rest ledger couldn't reach its server
+        raise IOError('Could not read the workdays between {} and {}'.format(start_date, end_date))
+    history = History(rows)
+    if not len(history):
+        return None
+    return format_stats(compute(history, target_secs))
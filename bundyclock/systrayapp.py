@@ -1,19 +1,36 @@
+import threading
+
 import pystray
 
-from pkg_resources import resource_filename
+from importlib.resources import files
 from PIL import Image
 
+from . import metrics
+
 import logging
 
 logger = logging.getLogger(__name__)
 
 
 class SystrayApp(pystray.Icon):
-    def __init__(self, ledger,  actioncb=None, cb_arg=None, **kwargs):
+    """
+    Tray icon and menu. Given a today summary, the time today is shown in the
+    tooltip and at the top of the menu, refreshed every TICK seconds, and
+    'show time today' doesn't touch the ledger.
+    """
+    TICK = 60
+
+    def __init__(self, ledger,  actioncb=None, cb_arg=None, today=None, **kwargs):
+        self.today = today
+        self._ticker_stopped = threading.Event()
+        items = [pystray.MenuItem(lambda item: self._today_label(), None, enabled=False),
+                 pystray.Menu.SEPARATOR] if today is not None else []
         super().__init__(
             'bundyclock',
-            icon=Image.open(resource_filename(__name__, 'service_files/bundyclock.png')),
+            icon=self._load_icon(),
+            title=self._today_label(),
             menu=pystray.Menu(
+                *items,
                 pystray.MenuItem('take a break', self.after_click),
                 pystray.Menu.SEPARATOR,
                 pystray.MenuItem('show time today', self.after_click),
@@ -23,19 +40,65 @@ class SystrayApp(pystray.Icon):
         self.ledger = ledger
         self.actioncb = actioncb
 
+    @staticmethod
+    def _load_icon():
+        with files(__package__).joinpath('service_files/bundyclock.png').open('rb') as png:
+            icon = Image.open(png)
+            icon.load()
+        return icon
+
     def after_click(self, icon, query):
+        with metrics.HANDLER_SECONDS.time(handler='systray'):
+            metrics.EVENTS.inc(event=str(query))
+            self._handle_click(icon, query)
+
+    def _handle_click(self, icon, query):
         if str(query) == "quit":
             self.ledger.update_in_out()
             logger.info("quit by user")
             icon.stop()
         elif str(query) == 'show time today':
-            self.ledger.update_in_out()
-            today_time = self.ledger.get_today()
-            self.notify(f"Start: {today_time.intime}. Time elapsed: {today_time.total}\n"
-                            f"Breaks {today_time.num_breaks} - {today_time.break_time}",
-                            "Bundyclock")
+            if self.today is not None:
+                self._notify_today(self.today.snapshot())
+            else:
+                self.ledger.update_in_out()
+                self.ledger.submit('get_today').add_done_callback(self.notify_today)
         elif str(query) == "take a break":
             self.ledger.take_a_break()
         
         if self.actioncb:
             self.actioncb(str(query))
+
+    def notify_today(self, future):
+        """ called by the ledger worker when today's time is available """
+        if future.exception():
+            return
+        self._notify_today(future.result())
+
+    def _notify_today(self, today_time):
+        if today_time is None:
+            return
+        self.notify(f"Start: {today_time.intime}. Time elapsed: {today_time.total}\n"
+                    f"Breaks {today_time.num_breaks} - {today_time.break_time}",
+                    "Bundyclock")
+
+    def _today_label(self):
+        today_time = self.today.snapshot() if self.today is not None else None
+        if today_time is None:
+            return 'bundyclock'
+        return f"In {today_time.intime[:5]}, {today_time.total[:5]} elapsed, " \
+            f"breaks {today_time.num_breaks} - {today_time.break_time[:5]}"
+
+    def start_ticking(self):
+        """ refresh the tooltip and menu every TICK seconds until stopped """
+        if self.today is not None:
+            threading.Thread(target=self._tick, name='bundyclock-tick', daemon=True).start()
+
+    def _tick(self):
+        while not self._ticker_stopped.wait(self.TICK):
+            self.title = self._today_label()
+            self.update_menu()
+
+    def stop(self):
+        self._ticker_stopped.set()
+        super().stop()
@@ -0,0 +1,85 @@
+"""
+Today's in time, elapsed time and breaks, kept in memory by the daemon.
+
+The summary is updated from the punches the daemon writes and ticks with
+the clock, so showing it takes no ledger I/O. The ledger is read once at
+start to pick up a day begun earlier.
+"""
+import threading
+import time
+
+from .ledgers.ledgers import PunchTime, SECONDS_PER_DAY
+
+
+def _local(now=None):
+    """ day and seconds since midnight of now in local time """
+    t = time.localtime(now)
+    return time.strftime('%Y-%m-%d', t), t.tm_hour * 3600 + t.tm_min * 60 + t.tm_sec
+
+
+class TodaySummary(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, day):
+        self.day = day
+        self.in_secs = None
+        self.out_secs = None
+        self.present = False
+        self.num_breaks = 0
+        self.break_secs = 0
+        self._break_start = None
+
+    def _roll_over(self, day):
+        if day != self.day:
+            self._reset(day)
+
+    def punch(self, present, now=None):
+        """ an in (present) or out punch at now """
+        day, secs = _local(now)
+        with self._lock:
+            self._roll_over(day)
+            if self.in_secs is None:
+                self.in_secs = secs
+            if present and self._break_start is not None:
+                self.break_secs += (secs - self._break_start) % SECONDS_PER_DAY
+                self._break_start = None
+            self.out_secs = secs
+            self.present = present
+
+    def take_a_break(self, now=None):
+        day, secs = _local(now)
+        with self._lock:
+            self._roll_over(day)
+            if self._break_start is None:
+                self.num_breaks += 1
+            # like the ledger, a break not yet ended is replaced by the new one
+            self._break_start = secs
+
+    def seed(self, workday):
+        """ in time and breaks of today's PunchTime from the ledger, if any """
+        if workday is None:
+            return
+        day, _ = _local()
+        with self._lock:
+            self._roll_over(day)
+            if self.in_secs is None or workday.in_secs < self.in_secs:
+                self.in_secs = workday.in_secs
+            if self.out_secs is None:
+                # no punch seen yet, the daemon runs while someone is logged in
+                self.out_secs = workday.out_secs
+                self.present = True
+            self.num_breaks += workday.num_breaks
+            self.break_secs += workday.break_secs or 0
+
+    def snapshot(self, now=None):
+        """ PunchTime of today up to now, None before the first punch """
+        day, secs = _local(now)
+        with self._lock:
+            self._roll_over(day)
+            if self.in_secs is None:
+                return None
+            out_secs = secs if self.present else self.out_secs
+            return PunchTime(day, self.in_secs, out_secs, (out_secs - self.in_secs) % SECONDS_PER_DAY,
+                             self.num_breaks, self.break_secs)
@@ -11,11 +11,15 @@ setup(
     entry_points={
         "console_scripts": [
             "bundyclock = bundyclock.bundyclock:main",
+            "bundyclock-server = bundyclock.restserver:main",
         ],
         "gui_scripts": [
             "bundyclockw = bundyclock.bundyclock:main",
         ],
     },
+    extras_require={
+        'stats': ['numpy'],
+    },
     include_package_data=True,
     package_data={
       'bundyclock': ['service_files/*', 'templates/*'],